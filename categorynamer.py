@@ -0,0 +1,226 @@
+'''
+Category naming for the term taxonomy.
+
+A namer takes the term groups of a taxonomy and returns a name for each one.
+Names are looked up in a persistent cache keyed by the sorted terms and the
+content context first. The groups that miss are sent several to a prompt,
+on a bounded pool of threads, with the requests spaced by a rate limit.
+
+`OpenAINamer` asks a chat model for the names. `StubNamer` builds them
+locally from the terms, for offline runs and tests.
+
+The namer is set with optional keys in the credentials file:
+
+    namer: openai               # or stub
+    model: gpt-4
+    naming_workers: 4           # concurrent requests
+    naming_rate: 60             # requests per minute
+    naming_batch: 5             # term groups per prompt
+    naming_cache: working/namecache.db
+
+'''
+
+import re
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import textcache as TC
+
+VERSION = "1.0"
+UNNAMED = "Unnamed Category"
+PROMPT_TERMS = 50
+WORKERS = 4
+RATE = 60
+BATCH = 5
+CACHE_PATH = "working/namecache.db"
+
+
+class RateLimiter:
+
+    def __init__(self, per_minute):
+        '''Allow at most per_minute calls to wait() to return each minute.'''
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''Block until the next call is allowed.'''
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class CategoryNamer(ABC):
+    '''Base class of the namers. Subclasses implement `name_batch`.'''
+
+    def __init__(self, context, cache=None, workers=WORKERS, rate=RATE, batch_size=BATCH):
+        '''context describes the content, cache is an optional
+        textcache.TextCache, workers the number of concurrent requests,
+        rate the requests per minute, and batch_size the term groups per
+        request.'''
+        self.context = context
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.batch_size = max(1, batch_size)
+
+    def describe(self):
+        '''Return the parameters that change the names, for the cache key.'''
+        return {"namer": type(self).__name__, "context": self.context}
+
+    def cache_key(self, terms):
+        '''Return the cache key for a term group.'''
+        content = TC.hash_text("\n".join(sorted(str(t) for t in terms)))
+        return TC.make_key("category", VERSION, self.describe(), content)
+
+    @abstractmethod
+    def name_batch(self, groups):
+        '''Return a list with a name for each term group, or None for a group
+        that could not be named.'''
+
+    def request(self, groups):
+        '''Name a batch of groups, waiting for the rate limit.'''
+        self.limiter.wait()
+        return self.name_batch(groups)
+
+    def name_all(self, groups):
+        '''With a list of term groups, return a list with the name of each
+        group. Groups that can't be named get "Unnamed Category", which is
+        not cached.'''
+        names = [None] * len(groups)
+        keys = [self.cache_key(g) for g in groups]
+        pending = {}
+        for index, key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                names[index] = cached
+            else:
+                pending.setdefault(key, []).append(index)
+
+        todo = list(pending.values())
+        batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+        if batches:
+            print("Naming {} categories in {} requests, {} cached.".format(
+                len(todo), len(batches), len(groups) - sum(len(i) for i in todo)))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.request, [groups[i[0]] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Error generating category names: {e}")
+                    results = [None] * len(batch)
+                for indexes, name in zip(batch, results):
+                    if name and self.cache is not None:
+                        self.cache.put(keys[indexes[0]], name)
+                    for index in indexes:
+                        names[index] = name
+        return [name or UNNAMED for name in names]
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+
+class StubNamer(CategoryNamer):
+    '''Names each group locally from its most common words and a short hash
+    of its terms, so names are stable between runs and don't collide. There
+    is no rate limit unless one is given.'''
+
+    def __init__(self, context, rate=0, **kwargs):
+        super().__init__(context, rate=rate, **kwargs)
+
+    def name_batch(self, groups):
+        return [self.name_group(g) for g in groups]
+
+    @staticmethod
+    def name_group(terms):
+        words = Counter()
+        for term in terms:
+            words.update(w.lower() for w in re.findall(r"[A-Za-z][A-Za-z0-9]+", str(term)))
+        common = [w for w, count in words.most_common(2)]
+        digest = hashlib.sha1("\n".join(sorted(str(t) for t in terms)).encode("utf-8")).hexdigest()[:6]
+        return "{} {}".format(" ".join(common).title() or "Category", digest)
+
+
+class OpenAINamer(CategoryNamer):
+    '''Names groups with an OpenAI chat model, several groups per prompt.'''
+
+    def __init__(self, context, api_key, model="gpt-4", **kwargs):
+        super().__init__(context, **kwargs)
+        import openai
+
+        openai.api_key = api_key
+        self.openai = openai
+        self.model = model
+
+    def describe(self):
+        return dict(super().describe(), model=self.model)
+
+    def make_prompt(self, groups):
+        '''Return the prompt that asks for one name per numbered group.'''
+        lines = [
+            "Summarize each of the following numbered lists of terms into a single noun or noun cluster.",
+            f"The context is {self.context}.",
+            "Reply with one line per list in the form '<number>. <name>' and nothing else.",
+            ""]
+        for number, terms in enumerate(groups, start=1):
+            lines.append("{}. {}".format(number, ", ".join(str(t) for t in terms[:PROMPT_TERMS])))
+        return "\n".join(lines)
+
+    @staticmethod
+    def parse_names(text, count):
+        '''Return the names in a numbered reply, None for any missing number.'''
+        names = [None] * count
+        for line in text.splitlines():
+            match = re.match(r"\s*(\d+)[.):]\s*(.+)", line)
+            if match:
+                number = int(match.group(1))
+                if 1 <= number <= count:
+                    names[number - 1] = match.group(2).strip().strip('"')
+        return names
+
+    def name_batch(self, groups):
+        response = self.openai.ChatCompletion.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that generates concise category names."},
+                {"role": "user", "content": self.make_prompt(groups)}
+            ],
+            max_tokens=30 * len(groups),
+            n=1,
+            temperature=0.7,
+        )
+        return self.parse_names(response['choices'][0]['message']['content'], len(groups))
+
+
+def get_namer(credentials):
+    '''Return the namer set in the credentials dict.'''
+    options = {
+        "workers": int(credentials.get("naming_workers", WORKERS)),
+        "batch_size": int(credentials.get("naming_batch", BATCH)),
+    }
+    if "naming_rate" in credentials:
+        options["rate"] = float(credentials["naming_rate"])
+    cache_path = credentials.get("naming_cache", CACHE_PATH)
+    if cache_path:
+        options["cache"] = TC.TextCache(cache_path)
+    context = credentials.get("content", "")
+    if str(credentials.get("namer", "openai")).lower() == "stub":
+        return StubNamer(context, **options)
+    return OpenAINamer(context, credentials["openai-key"], credentials.get("model", "gpt-4"), **options)
+
+
+def main():
+    print("This module contains the category namers for the taxonomy.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+'''
+In-memory retrieval engine for the golden queries.
+
+Loads the Content, Term, and Category nodes and the CHILD_OF, MENTION,
+HAS_TERM, and HAS_CHILD edges into compressed sparse row (CSR) adjacency
+arrays with integer node ids, one array pair for each edge type and
+direction. The graph is loaded from Neo4j, or without a database from the
+neo4j-admin import files written by `tocgrapher` and the category tree
+written by `toctaxonomy --dry-run`.
+
+The engine answers the query shapes used in queries.yml, a single MATCH
+path with equality conditions, such as:
+
+    MATCH (t:Term)-[:MENTION]-(c:Content) WHERE t.name = $term
+    RETURN c.node_id AS content_id
+
+    MATCH (cat:Category)-[:HAS_TERM]->(t:Term)-[:MENTION]-(c:Content)
+    WHERE cat.name = $category RETURN c.node_id AS content_id
+
+Relationships can be variable length, as in `-[:HAS_CHILD*]->`. Each node
+is returned once, in load order, or sorted by the returned property when
+the query ends with `ORDER BY` on it. Neo4j returns a row per path, so
+`out_fscore` drops repeated ids from both backends before scoring. `LIMIT`
+needs `RETURN DISTINCT`, since Neo4j counts rows and the engine counts
+nodes. Each parsed query is cached, so a query runs as a few array lookups.
+
+`GraphEngine.session()` returns the engine itself. It has the `run(query,
+parameters)` method of a Neo4j session, so `out_fscore` can use it instead
+of the database.
+
+'''
+
+import os
+import re
+import csv
+import json
+
+import numpy as np
+
+import tocformats as TF
+
+PROPERTIES = {
+    "Content": ("node_id", "name", "content_type", "href", "toc_path"),
+    "Term": ("term_id", "name"),
+    "Category": ("name", "id"),
+}
+SCHEMA = {
+    "CHILD_OF": ("Content", "Content"),
+    "MENTION": ("Content", "Term"),
+    "HAS_TERM": ("Category", "Term"),
+    "HAS_CHILD": ("Category", "Category"),
+}
+ADMIN_KINDS = {"content": "Content", "term": "Term", "child_of": "CHILD_OF", "mention": "MENTION"}
+EMPTY = np.zeros(0, dtype=np.int64)
+
+NODE = re.compile(r"\(\s*(\w*)\s*(?::\s*(\w+))?\s*(?:\{\s*(\w+)\s*:\s*([^}]*?)\s*\})?\s*\)")
+RELATIONSHIP = re.compile(r"\s*(<?)-\[\s*\w*\s*:\s*(\w+)\s*(\*\s*(\d*)\s*(\.\.)?\s*(\d*))?\s*\]-(>?)\s*")
+QUERY = re.compile(r"^\s*MATCH\s+(?P<path>.+?)\s+(?:WHERE\s+(?P<where>.+?)\s+)?"
+                   r"RETURN\s+(?P<distinct>DISTINCT\s+)?(?P<var>\w+)\.(?P<property>\w+)(?:\s+AS\s+(?P<alias>\w+))?"
+                   r"(?:\s+ORDER\s+BY\s+(?P<order>\w+(?:\.\w+)?)(?:\s+(?P<direction>ASC|ASCENDING|DESC|DESCENDING))?)?"
+                   r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$", re.I | re.S)
+CONDITION = re.compile(r"^\s*(\w+)\.(\w+)\s*=\s*(.+?)\s*$", re.S)
+FLIP = {"out": "in", "in": "out", "both": "both"}
+
+
+def parse_value(text):
+    '''Return ("parameter", name) or ("literal", value) for a Cypher value.'''
+    if text.startswith("$"):
+        return "parameter", text[1:]
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return "literal", re.sub(r"\\(.)", r"\1", text[1:-1])
+    raise ValueError(f"Unsupported value: {text}")
+
+
+def to_csr(starts, ends, count):
+    '''Return the indptr and indices arrays of the edges from starts to ends,
+    with duplicate edges removed.'''
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if starts.size:
+        width = int(ends.max()) + 1
+        pairs = np.unique(starts * width + ends)
+        starts, ends = pairs // width, pairs % width
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(starts, minlength=count), out=indptr[1:])
+    return indptr, ends
+
+
+def gather(indptr, indices, nodes):
+    '''Return the sorted unique neighbors of nodes in a CSR array pair.'''
+    firsts = indptr[nodes]
+    counts = indptr[nodes + 1] - firsts
+    total = int(counts.sum())
+    if not total:
+        return EMPTY
+    offsets = np.repeat(firsts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+    return np.unique(indices[offsets])
+
+
+class GraphEngine:
+
+    def __init__(self):
+        self.keys = {label: {} for label in PROPERTIES}
+        self.properties = {label: {p: [] for p in PROPERTIES[label]} for label in PROPERTIES}
+        self.edges = {rel: ([], []) for rel in SCHEMA}
+        self.adjacency = {}
+        self.indexes = {}
+        self.plans = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def session(self, **kwargs):
+        '''Return the engine, which runs queries like a Neo4j session.'''
+        return self
+
+    def close(self):
+        pass
+
+    def count(self, label):
+        return len(self.keys[label])
+
+    def add_node(self, label, key, properties=None):
+        '''Add a node by the value of its key property, the first in
+        PROPERTIES, and return its integer id. Properties of a node that
+        was already added fill in the ones it is missing.'''
+        nodes = self.keys[label]
+        values = self.properties[label]
+        index = nodes.get(key)
+        if index is None:
+            index = nodes[key] = len(nodes)
+            for name, column in values.items():
+                column.append(None)
+            values[PROPERTIES[label][0]][index] = key
+        for name, value in (properties or {}).items():
+            if name in values and value not in (None, "") and values[name][index] is None:
+                values[name][index] = value
+        return index
+
+    def add_edge(self, rel, start_key, end_key):
+        start_label, end_label = SCHEMA[rel]
+        starts, ends = self.edges[rel]
+        starts.append(self.add_node(start_label, start_key))
+        ends.append(self.add_node(end_label, end_key))
+
+    def finish(self):
+        '''Build the CSR arrays of each edge type in both directions.'''
+        for rel, (starts, ends) in self.edges.items():
+            start_label, end_label = SCHEMA[rel]
+            out = to_csr(starts, ends, self.count(start_label))
+            self.adjacency[(rel, "out")] = out
+            count = np.diff(out[0])
+            self.adjacency[(rel, "in")] = to_csr(out[1], np.repeat(np.arange(self.count(start_label)), count),
+                                                 self.count(end_label))
+            self.edges[rel] = ([], [])
+        self.indexes = {}
+        return self
+
+    def load_admin(self, folder):
+        '''Load the nodes and edges in the neo4j-admin import files in folder.'''
+        for kind, name in ADMIN_KINDS.items():
+            if not os.path.exists(os.path.join(folder, "{}-header.csv".format(kind))):
+                continue
+            files = TF.get_admin_files(folder, kind)
+            with open(files[0], "r", newline="", encoding="utf-8") as stream:
+                header = [c.split(":")[0] or c.split("(")[0] for c in next(csv.reader(stream))]
+            for path in files[1:]:
+                with open(path, "r", newline="", encoding="utf-8") as stream:
+                    for row in csv.reader(stream):
+                        record = dict(zip(header, row))
+                        if name in SCHEMA:
+                            self.add_edge(name, record[":START_ID"], record[":END_ID"])
+                        else:
+                            self.add_node(name, record[PROPERTIES[name][0]], record)
+        return self
+
+    def load_taxonomy(self, path):
+        '''Load the categories in a category tree written by a taxonomy dry
+        run, as one JSON object or as JSON lines of subtrees.'''
+        with open(path, "r", encoding="utf-8") as stream:
+            text = stream.read()
+        try:
+            trees = [json.loads(text)]
+        except ValueError:
+            trees = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for tree in trees:
+            categories = tree.get("categories", [])
+            self.add_node("Category", tree["root"])
+            for category in categories:
+                parent = tree["root"] if category["parent"] is None else categories[category["parent"]]["name"]
+                if parent != category["name"]:
+                    self.add_edge("HAS_CHILD", parent, category["name"])
+                for term in category["terms"]:
+                    self.add_edge("HAS_TERM", category["name"], term)
+        return self
+
+    def load_neo4j(self, credentials_path=None):
+        '''Load the nodes and edges from Neo4j.'''
+        import neoconnect as NC
+
+        path = credentials_path or NC.CREDENTIALS_PATH
+        with NC.session(path) as session:
+            for label, names in PROPERTIES.items():
+                query = "MATCH (n:{}) RETURN {}".format(label, ", ".join(f"n.{p} AS {p}" for p in names))
+                for record in session.run(query):
+                    if record[names[0]] is not None:
+                        self.add_node(label, record[names[0]], dict(record))
+            for rel, (start_label, end_label) in SCHEMA.items():
+                query = "MATCH (a:{})-[:{}]->(b:{}) RETURN a.{} AS start, b.{} AS end".format(
+                    start_label, rel, end_label, PROPERTIES[start_label][0], PROPERTIES[end_label][0])
+                for record in session.run(query):
+                    if record["start"] is not None and record["end"] is not None:
+                        self.add_edge(rel, record["start"], record["end"])
+        return self
+
+    def lookup(self, label, name, value):
+        '''Return the ids of the nodes with a property value.'''
+        if name == PROPERTIES[label][0]:
+            index = self.keys[label].get(value)
+            return EMPTY if index is None else np.array([index], dtype=np.int64)
+        if (label, name) not in self.indexes:
+            if name not in self.properties[label]:
+                raise ValueError(f"Unsupported property: {label}.{name}")
+            index = {}
+            for node, v in enumerate(self.properties[label][name]):
+                index.setdefault(v, []).append(node)
+            self.indexes[(label, name)] = {v: np.array(n, dtype=np.int64) for v, n in index.items()}
+        return self.indexes[(label, name)].get(value, EMPTY)
+
+    def neighbors(self, rel, direction, nodes):
+        if direction == "both":
+            return np.union1d(gather(*self.adjacency[(rel, "out")], nodes), gather(*self.adjacency[(rel, "in")], nodes))
+        return gather(*self.adjacency[(rel, direction)], nodes)
+
+    def expand(self, hop, direction, nodes):
+        '''Return the nodes reached from nodes over between low and high
+        edges of one type. Unbounded hops stop at nodes already reached.'''
+        rel, low, high = hop["rel"], hop["low"], hop["high"]
+        reached = [nodes] if low == 0 else []
+        visited = None
+        depth = 0
+        while nodes.size and (high is None or depth < high):
+            nodes = self.neighbors(rel, direction, nodes)
+            depth += 1
+            if high is None and depth >= low:
+                if visited is None:
+                    visited = np.zeros(self.count(SCHEMA[rel][0]), dtype=bool)
+                nodes = nodes[~visited[nodes]]
+                visited[nodes] = True
+            if depth >= low:
+                reached.append(nodes)
+        if not reached:
+            return EMPTY
+        return np.unique(np.concatenate(reached))
+
+    def plan(self, query):
+        '''Parse a query into its nodes, hops, and return item. Plans are cached.'''
+        if query in self.plans:
+            return self.plans[query]
+        match = QUERY.match(query)
+        if not match or re.match(r"\s*(PROFILE|EXPLAIN)\b", query, re.I):
+            raise ValueError(f"Unsupported query: {query.strip()}")
+
+        nodes = []
+        hops = []
+        path = match.group("path").strip()
+        position = 0
+        while True:
+            node = NODE.match(path, position)
+            if not node:
+                raise ValueError(f"Unsupported pattern: {path}")
+            conditions = [(node.group(3), parse_value(node.group(4)))] if node.group(3) else []
+            nodes.append({"var": node.group(1), "label": node.group(2), "conditions": conditions})
+            position = node.end()
+            if position == len(path):
+                break
+            rel = RELATIONSHIP.match(path, position)
+            if not rel or rel.group(2) not in SCHEMA or (rel.group(1) and rel.group(7)):
+                raise ValueError(f"Unsupported pattern: {path}")
+            if rel.group(3) and len(set(SCHEMA[rel.group(2)])) > 1:
+                raise ValueError(f"Variable length {rel.group(2)} is not supported: {path}")
+            low = high = 1
+            if rel.group(3):
+                low = int(rel.group(4)) if rel.group(4) else 1
+                if rel.group(5):
+                    high = int(rel.group(6)) if rel.group(6) else None
+                else:
+                    high = low if rel.group(4) else None
+            direction = "out" if rel.group(7) else "in" if rel.group(1) else "both"
+            hops.append({"rel": rel.group(2), "direction": direction, "low": low, "high": high})
+            position = rel.end()
+
+        # Check the labels against the schema, filling in the ones left out. A
+        # pattern the schema can't match returns nothing, as it would in Neo4j.
+        empty = any(node["label"] not in (None, *PROPERTIES) for node in nodes)
+        for i, hop in enumerate(hops):
+            start_label, end_label = SCHEMA[hop["rel"]]
+            if hop["direction"] == "both" and start_label != end_label:
+                if nodes[i]["label"] == end_label or nodes[i + 1]["label"] == start_label:
+                    hop["direction"] = "in"
+                elif nodes[i]["label"] == start_label or nodes[i + 1]["label"] == end_label:
+                    hop["direction"] = "out"
+                elif nodes[i]["label"] is None and nodes[i + 1]["label"] is None:
+                    raise ValueError(f"Unsupported pattern, the labels are ambiguous: {path}")
+                else:
+                    empty = True
+            if hop["direction"] == "in":
+                start_label, end_label = end_label, start_label
+            for node, label in ((nodes[i], start_label), (nodes[i + 1], end_label)):
+                if node["label"] is None:
+                    node["label"] = label
+                elif node["label"] != label:
+                    empty = True
+        if any(node["label"] is None for node in nodes):
+            raise ValueError(f"Unsupported pattern, a label is missing: {path}")
+
+        variables = {node["var"]: i for i, node in enumerate(nodes) if node["var"]}
+        if match.group("where"):
+            for condition in re.split(r"\s+AND\s+", match.group("where").strip(), flags=re.I):
+                parts = CONDITION.match(condition)
+                if not parts or parts.group(1) not in variables:
+                    raise ValueError(f"Unsupported condition: {condition}")
+                nodes[variables[parts.group(1)]]["conditions"].append((parts.group(2), parse_value(parts.group(3))))
+        if match.group("var") not in variables:
+            raise ValueError(f"Unknown variable: {match.group('var')}")
+        alias = match.group("alias") or "{}.{}".format(match.group("var"), match.group("property"))
+        order = match.group("order")
+        if order and order not in (alias, "{}.{}".format(match.group("var"), match.group("property"))):
+            raise ValueError(f"Unsupported ORDER BY, it must be the returned item: {order}")
+        if match.group("limit") and not match.group("distinct"):
+            raise ValueError("Unsupported LIMIT without RETURN DISTINCT, Neo4j would count repeated rows")
+
+        plan = {
+            "nodes": nodes,
+            "hops": hops,
+            "target": variables[match.group("var")],
+            "property": match.group("property"),
+            "alias": alias,
+            "order": bool(order),
+            "descending": (match.group("direction") or "").upper().startswith("DESC"),
+            "limit": int(match.group("limit")) if match.group("limit") else None,
+            "empty": empty,
+        }
+        self.plans[query] = plan
+        return plan
+
+    def select(self, node, parameters):
+        '''Return the ids of the nodes that meet the conditions of a pattern
+        node, or None for all nodes of its label.'''
+        selected = None
+        for name, (kind, value) in node["conditions"]:
+            if kind == "parameter":
+                if value not in parameters:
+                    raise ValueError(f"Missing parameter: {value}")
+                value = parameters[value]
+            found = self.lookup(node["label"], name, value)
+            selected = found if selected is None else np.intersect1d(selected, found, assume_unique=True)
+        return selected
+
+    def sweep(self, plan, start, stop, parameters):
+        '''Return the nodes at position stop of the path that can be reached
+        from the nodes that meet the conditions at position start.'''
+        nodes = plan["nodes"]
+        current = self.select(nodes[start], parameters)
+        if current is None:
+            current = np.arange(self.count(nodes[start]["label"]), dtype=np.int64)
+        step = 1 if stop > start else -1
+        for i in range(start, stop, step):
+            hop = plan["hops"][min(i, i + step)]
+            current = self.expand(hop, hop["direction"] if step == 1 else FLIP[hop["direction"]], current)
+            selected = self.select(nodes[i + step], parameters)
+            if selected is not None:
+                current = np.intersect1d(current, selected, assume_unique=True)
+        return current
+
+    def match(self, query, parameters=None):
+        '''Return the ids and label of the nodes a query returns.'''
+        plan = self.plan(query)
+        parameters = parameters or {}
+        target = plan["target"]
+        if plan["empty"]:
+            return EMPTY, plan["nodes"][target]["label"]
+        last = len(plan["nodes"]) - 1
+        found = None
+        if target > 0 or last == 0:
+            found = self.sweep(plan, 0, target, parameters)
+        if target < last:
+            right = self.sweep(plan, last, target, parameters)
+            found = right if found is None else np.intersect1d(found, right, assume_unique=True)
+        label = plan["nodes"][target]["label"]
+        if plan["order"]:
+            found = self.sort(found, label, plan["property"], plan["descending"])
+        if plan["limit"] is not None:
+            found = found[:plan["limit"]]
+        return found, label
+
+    def sort(self, found, label, name, descending=False):
+        '''Return the node ids sorted by a property, with ties in load order.
+        Nodes without the property come last, or first when descending, as in
+        Neo4j.'''
+        if name not in self.properties[label]:
+            raise ValueError(f"Unsupported property: {label}.{name}")
+        column = self.properties[label][name]
+        present = [i for i in found.tolist() if column[i] is not None]
+        missing = [i for i in found.tolist() if column[i] is None]
+        present.sort(key=column.__getitem__, reverse=descending)
+        ordered = missing + present if descending else present + missing
+        return np.asarray(ordered, dtype=np.int64)
+
+    def run(self, query, parameters=None, **kwargs):
+        '''Run a query and return its records as dicts.'''
+        plan = self.plan(query)
+        found, label = self.match(query, dict(parameters or {}, **kwargs))
+        if plan["empty"]:
+            return []
+        if plan["property"] not in self.properties[label]:
+            raise ValueError(f"Unsupported property: {label}.{plan['property']}")
+        column = self.properties[label][plan["property"]]
+        return [{plan["alias"]: column[i]} for i in found.tolist()]
+
+
+def load_engine(graph="neo4j", taxonomy=None, credentials_path=None):
+    '''Return an engine loaded from Neo4j, or from the neo4j-admin import
+    files in the graph folder and the optional taxonomy dry run file.'''
+    engine = GraphEngine()
+    if graph == "neo4j":
+        engine.load_neo4j(credentials_path)
+    else:
+        engine.load_admin(graph)
+    if taxonomy:
+        engine.load_taxonomy(taxonomy)
+    engine.finish()
+    edges = sum(len(indices) for (rel, direction), (indptr, indices) in engine.adjacency.items() if direction == "out")
+    print("Loaded {} content, {} term, and {} category nodes and {} edges.".format(
+        engine.count("Content"), engine.count("Term"), engine.count("Category"), edges))
+    return engine
+
+
+def main():
+    print("This module contains the in-memory retrieval engine for the golden queries.")
+
+if __name__ == "__main__":
+    main()
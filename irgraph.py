@@ -0,0 +1,95 @@
+'''
+Command line for the information retrieval graph scripts.
+
+    python irgraph.py ingest [--config jobtoc.yml]
+    python irgraph.py keywords
+    python irgraph.py taxonomy [--credentials working/fowler.yml] [--dry-run output/taxonomy.json] [--stream | --incremental]
+    python irgraph.py score [--queries queries.yml] [--workers 8] [--repeat 3] [--profile profile|explain] [--backend neo4j|memory]
+    python irgraph.py hierarchy --root <category id> [--output output/hierarchy_output.txt] [--format text|json|csv]
+
+Each command imports only the modules it runs, so commands that don't
+extract text or cluster terms don't load NLTK, scikit-learn, or OpenAI.
+
+'''
+
+import argparse
+
+
+def run_ingest(args):
+    '''Graph the TOCs in the job config.'''
+    import tocgrapher
+
+    tocgrapher.main(args.config)
+
+
+def run_keywords(args):
+    '''Create the Term nodes and MENTION edges from the Content keywords.'''
+    import tockeywords
+
+    tockeywords.main()
+
+
+def run_taxonomy(args):
+    '''Cluster the terms into categories.'''
+    import toctaxonomy
+
+    toctaxonomy.main(args.credentials, args.dry_run, args.stream, args.incremental)
+
+
+def run_score(args):
+    '''Write the F-score report for the golden queries.'''
+    import out_fscore
+
+    out_fscore.main(args.queries, args.workers, args.repeat, args.profile, args.backend)
+
+
+def run_hierarchy(args):
+    '''Write the category hierarchy under a root category.'''
+    import out_hierarchy
+
+    out_hierarchy.main(args.root, args.output, args.format)
+
+
+def get_parser():
+    '''Return the argument parser for the commands.'''
+    parser = argparse.ArgumentParser(prog="irgraph", description="Build and report on the information retrieval graph.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Graph the TOCs and pages in the job config.")
+    ingest.add_argument("--config", default="jobtoc.yml", help="Path to the job config.")
+    ingest.set_defaults(func=run_ingest)
+
+    keywords = commands.add_parser("keywords", help="Create Term nodes and MENTION edges.")
+    keywords.set_defaults(func=run_keywords)
+
+    taxonomy = commands.add_parser("taxonomy", help="Cluster the terms into categories.")
+    taxonomy.add_argument("--credentials", default="working/fowler.yml", help="Path to the credentials file.")
+    taxonomy.add_argument("--dry-run", metavar="PATH", help="Write the category tree to a JSON file instead of Neo4j.")
+    mode = taxonomy.add_mutually_exclusive_group()
+    mode.add_argument("--stream", action="store_true", help="Cluster in bounded memory, for very large term sets.")
+    mode.add_argument("--incremental", action="store_true", help="Place new terms in the existing taxonomy.")
+    taxonomy.set_defaults(func=run_taxonomy)
+
+    score = commands.add_parser("score", help="Write the F-score report.")
+    score.add_argument("--queries", default="queries.yml", help="Path to the queries file.")
+    score.add_argument("--workers", type=int, help="Queries to run at the same time.")
+    score.add_argument("--repeat", type=int, help="Runs of each query, for the latency percentiles.")
+    score.add_argument("--profile", choices=["profile", "explain"], help="Also write the query plans to output/query_profile.json.")
+    score.add_argument("--backend", choices=["neo4j", "memory"], help="Run the queries in Neo4j or in the in-memory engine.")
+    score.set_defaults(func=run_score)
+
+    hierarchy = commands.add_parser("hierarchy", help="Write the category hierarchy.")
+    hierarchy.add_argument("--root", required=True, help="Id of the root category.")
+    hierarchy.add_argument("--output", default="output/hierarchy_output.txt", help="Path to the output file.")
+    hierarchy.add_argument("--format", choices=["text", "json", "csv"], help="Output format. By default it comes from the output file extension.")
+    hierarchy.set_defaults(func=run_hierarchy)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''
+Shared Neo4j connection manager.
+
+Loads the credentials in working/fowler.yml once and holds one pooled driver
+per process, so scripts, threads, and pool workers borrow sessions from the
+same connection pool instead of opening a new driver for each TOC or query.
+
+The pool can be tuned with optional keys in the credentials file:
+
+    pool_size: 50               # max connections in the pool
+    acquisition_timeout: 60     # seconds to wait for a free connection
+    fetch_size: 1000            # records fetched per round trip
+
+'''
+
+import os
+import atexit
+import threading
+
+import yaml
+
+CREDENTIALS_PATH = "working/fowler.yml"
+POOL_SIZE = 50
+ACQUISITION_TIMEOUT = 60
+FETCH_SIZE = 1000
+
+CREDENTIALS = {}
+DRIVERS = {}
+LOCK = threading.Lock()
+
+
+def load_credentials(path=CREDENTIALS_PATH):
+    '''Load the credentials YAML file. The file is read once per process.'''
+    if path not in CREDENTIALS:
+        with open(path, "r") as stream:
+            CREDENTIALS[path] = yaml.safe_load(stream)
+    return CREDENTIALS[path]
+
+
+def get_fetch_size(path=CREDENTIALS_PATH):
+    '''Return the fetch size set in the credentials file.'''
+    return int(load_credentials(path).get("fetch_size", FETCH_SIZE))
+
+
+def get_driver(path=CREDENTIALS_PATH):
+    '''Return the pooled driver for the credentials file, creating it on first
+    use in this process. A driver inherited from a parent process is not
+    reused, since its connections belong to the parent.'''
+    key = (path, os.getpid())
+    driver = DRIVERS.get(key)
+    if driver is not None:
+        return driver
+    with LOCK:
+        if key not in DRIVERS:
+            from neo4j import GraphDatabase
+
+            credentials = load_credentials(path)
+            DRIVERS[key] = GraphDatabase.driver(
+                credentials["domain"],
+                auth=(credentials["username"], credentials["password"]),
+                max_connection_pool_size=int(credentials.get("pool_size", POOL_SIZE)),
+                connection_acquisition_timeout=float(credentials.get("acquisition_timeout", ACQUISITION_TIMEOUT)),
+            )
+        return DRIVERS[key]
+
+
+def session(path=CREDENTIALS_PATH, **kwargs):
+    '''Borrow a session from the pooled driver with the configured fetch size.'''
+    kwargs.setdefault("fetch_size", get_fetch_size(path))
+    return get_driver(path).session(**kwargs)
+
+
+def close():
+    '''Close the drivers opened by this process.'''
+    with LOCK:
+        for key in [k for k in DRIVERS if k[1] == os.getpid()]:
+            DRIVERS.pop(key).close()
+
+
+atexit.register(close)
+
+
+def main():
+    print("This module contains the shared Neo4j connection manager.")
+
+if __name__ == "__main__":
+    main()
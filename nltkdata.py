@@ -0,0 +1,66 @@
+'''
+Offline check for the NLTK data the scripts need.
+
+The scripts don't download NLTK data when they start. Instead they look for
+the resources on the local NLTK data path and stop with the download
+command if any are missing. Each resource lists the paths used by NLTK 3.8
+and by NLTK 3.9 and later, and is found if either one exists.
+
+'''
+
+RESOURCES = {
+    "punkt": ("tokenizers/punkt", "tokenizers/punkt_tab"),
+    "averaged_perceptron_tagger": ("taggers/averaged_perceptron_tagger",
+                                   "taggers/averaged_perceptron_tagger_eng"),
+    "stopwords": ("corpora/stopwords",),
+}
+
+INGEST = ["punkt", "averaged_perceptron_tagger", "stopwords"]
+TAXONOMY = ["punkt"]
+
+
+def find_resource(paths):
+    '''Return True if any of the NLTK data paths exists locally.'''
+    import nltk.data
+
+    for path in paths:
+        try:
+            nltk.data.find(path)
+            return True
+        except LookupError:
+            continue
+    return False
+
+
+def missing_resources(names):
+    '''With a list of resource names, return the names that are not installed.'''
+    return [name for name in names if not find_resource(RESOURCES[name])]
+
+
+def download_command(names):
+    '''Return the command that installs the named resources.'''
+    packages = []
+    for name in names:
+        packages.extend(path.split("/")[1] for path in RESOURCES[name])
+    return "python -m nltk.downloader {}".format(" ".join(packages))
+
+
+def check_resources(names):
+    '''Raise a LookupError naming the download command if any of the named
+    resources is not installed.'''
+    missing = missing_resources(names)
+    if missing:
+        raise LookupError("Missing NLTK data: {}. Install it with: {}".format(
+            ", ".join(missing), download_command(missing)))
+
+
+def main():
+    missing = missing_resources(list(RESOURCES))
+    if missing:
+        print("Missing NLTK data: {}".format(", ".join(missing)))
+        print(download_command(missing))
+    else:
+        print("All NLTK data is installed.")
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,209 @@
+'''
+Scores the golden queries in queries.yml against the graph.
+
+Queries run concurrently over the shared Neo4j driver, a batch of queries
+per session. Each query gets the parameters named in its text, such as
+`$term` or `$category`, set to its golden query key, so a query can be
+written once under `templates` and used by name. The report has precision,
+recall, and F-score, the ranking scores P@k, MAP, and nDCG@k, and latency
+percentiles over repeated runs of each query.
+
+The ids a query returns are deduplicated in the order they are first seen.
+Row order is only defined when the query ends with ORDER BY, so the ranking
+scores are only reported for those queries, and are n/a for the others.
+
+The run is set with an optional `settings` block in queries.yml:
+
+    settings:
+      workers: 8        # queries run at the same time
+      batch: 25         # queries run in each session
+      repeat: 1         # runs of each query, for the latency percentiles
+      k: 10             # cutoff for P@k and nDCG@k
+      template: term    # template used for golden queries without a query
+      profile: profile  # also run each query under PROFILE or EXPLAIN
+      backend: memory   # run the queries in graphengine instead of Neo4j
+      graph: output/import       # neo4j, or a neo4j-admin import folder
+      taxonomy: output/taxonomy.json  # optional taxonomy dry run file
+
+With `profile` set, each query is run once more under PROFILE, or only
+planned under EXPLAIN, and its operators, db hits, and rows are written to
+output/query_profile.json. Queries with a plan that scans all nodes, a
+whole label, or a whole relationship type are flagged as full scans. The
+file has no timings, so it can be diffed between graph versions.
+
+With the memory backend, the graph is loaded once into `graphengine`, from
+Neo4j or from the import files, and the queries run in process. Profiling
+needs the neo4j backend.
+
+'''
+
+import re
+import math
+import time
+import json
 import yaml
-from neo4j import GraphDatabase
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import neoconnect as NC
+
+PARAMETER = re.compile(r"\$(\w+)")
+RETURN = re.compile(r"\bRETURN\b", re.IGNORECASE)
+ORDER_BY = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+COMMENT = re.compile(r"//[^\n]*")
+PROFILE_MODES = ("profile", "explain")
+FULL_SCANS = {
+    "AllNodesScan",
+    "NodeByLabelScan",
+    "DirectedAllRelationshipsScan",
+    "UndirectedAllRelationshipsScan",
+    "DirectedRelationshipTypeScan",
+    "UndirectedRelationshipTypeScan",
+}
+
+# Defaults for the optional settings block in queries.yml
+SETTINGS = {
+    "workers": 8,      # queries run at the same time
+    "batch": 25,       # queries run in each session
+    "repeat": 1,       # runs of each query, for the latency percentiles
+    "k": 10,           # cutoff for P@k and nDCG@k
+    "template": None,  # template used for golden queries without a query
+    "profile": None,   # profile or explain, to write the query plans
+    "backend": "neo4j",  # neo4j or memory
+    "graph": "neo4j",  # source of the memory backend: neo4j or an import folder
+    "taxonomy": None,  # taxonomy dry run file for the memory backend
+}
+
+
+def infer_parameters(query, value):
+    """Return the parameters of a query, each set to the golden query key"""
+    return {name: value for name in PARAMETER.findall(query)}
+
+
+def is_ranked(query):
+    """True if the rows of a query are ordered by an ORDER BY after its last RETURN"""
+    query = COMMENT.sub("", query)
+    returns = list(RETURN.finditer(query))
+    return bool(returns) and ORDER_BY.search(query, returns[-1].end()) is not None
+
+
+def dedupe(retrieved):
+    """Return the retrieved ids without repeats, in the order they are first seen"""
+    return list(dict.fromkeys(retrieved))
+
+
+def precision_at_k(relevant_set, retrieved, k):
+    """Share of the first k retrieved results that are relevant. retrieved
+    holds unique ids"""
+    if k <= 0:
+        return 0.0
+    return sum(1 for r in retrieved[:k] if r in relevant_set) / k
+
+
+def average_precision(relevant_set, retrieved):
+    """Mean of the precision at the rank of each relevant result retrieved,
+    over all the relevant results. retrieved holds unique ids"""
+    if not relevant_set:
+        return 0.0
+    hits = 0
+    total = 0.0
+    for rank, r in enumerate(retrieved, start=1):
+        if r in relevant_set:
+            hits += 1
+            total += hits / rank
+    return total / len(relevant_set)
+
+
+def ndcg_at_k(relevant_set, retrieved, k):
+    """Normalized discounted cumulative gain of the first k results, with
+    binary relevance. retrieved holds unique ids"""
+    dcg = 0.0
+    for rank, r in enumerate(retrieved[:k], start=1):
+        if r in relevant_set:
+            dcg += 1.0 / math.log2(rank + 1)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant_set), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def format_score(score):
+    """Format a score for the text report, or n/a for a ranking score that isn't defined"""
+    return "n/a" if score is None else f"{score:.2f}"
+
+
+def latency_stats(latencies):
+    """Return the p50, p95, p99, and max of a list of latencies in milliseconds"""
+    if not latencies:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    values = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+
+
+def get_operator(plan):
+    """Return the operator name of a plan node, without the runtime suffix"""
+    return str(plan.get("operatorType", "")).split("@")[0]
+
+
+def flatten_plan(plan):
+    """Return the operators of a query plan, root first, with their depth"""
+    operators = []
+    stack = [(plan, 0)]
+    while stack:
+        node, depth = stack.pop()
+        args = node.get("args", {})
+        operators.append({
+            "operator": get_operator(node),
+            "depth": depth,
+            "details": args.get("Details", ""),
+            "estimated_rows": round(float(args.get("EstimatedRows", 0)), 1),
+            "db_hits": node.get("dbHits"),
+            "rows": node.get("rows"),
+        })
+        stack.extend((child, depth + 1) for child in reversed(node.get("children", [])))
+    return operators
+
+
+def summarize_plan(plan, profiled):
+    """Return the totals, scans, and seeks of a query plan"""
+    operators = flatten_plan(plan)
+    scans = sorted({o["operator"] for o in operators if o["operator"] in FULL_SCANS})
+    seeks = sorted({o["operator"] for o in operators if "Seek" in o["operator"]})
+    return {
+        "db_hits": sum(o["db_hits"] or 0 for o in operators) if profiled else None,
+        "rows": plan.get("rows") if profiled else None,
+        "full_scan": bool(scans),
+        "scans": scans,
+        "seeks": seeks,
+        "operators": operators,
+    }
+
 
 class FScoreCalculator:
 
-    def __init__(self):
-        # Initialize the Neo4j driver
-        with open("working/fowler.yml", "r") as stream:
-            self.credentials = yaml.safe_load(stream)
-        self.driver = GraphDatabase.driver(
-            self.credentials["domain"],
-            auth=(self.credentials["username"], self.credentials["password"])
-        )
+    def __init__(self, settings=None):
+        self.settings = dict(SETTINGS, **(settings or {}))
+        if self.settings["backend"] == "memory":
+            # Run the queries in the in-memory engine
+            import graphengine as GE
+
+            self.engine = GE.load_engine(self.settings["graph"], self.settings["taxonomy"])
+            self.session = self.engine.session
+        else:
+            # Borrow the shared Neo4j driver
+            self.credentials = NC.load_credentials()
+            self.driver = NC.get_driver()
+            self.session = NC.session
 
     def close(self):
         # Close the driver connection
-        self.driver.close()
+        NC.close()
 
     def calculate_f_score(self, relevant_results, retrieved_results):
         relevant_set = set(relevant_results)
         retrieved_set = set(retrieved_results)
-        
+
         true_positives = len(relevant_set & retrieved_set)
         precision = true_positives / len(retrieved_set) if retrieved_set else 0
         recall = true_positives / len(relevant_set) if relevant_set else 0
@@ -29,70 +212,224 @@ class FScoreCalculator:
         f_score = 2 * (precision * recall) / (precision + recall)
         return precision, recall, f_score
 
+    def calculate_metrics(self, relevant_results, retrieved_results, ranked=True):
+        # Set based scores, plus ranking scores on the retrieved order when it is defined
+        relevant_set = set(relevant_results)
+        precision, recall, f_score = self.calculate_f_score(relevant_results, retrieved_results)
+        k = self.settings["k"]
+        return {
+            "precision": precision,
+            "recall": recall,
+            "f_score": f_score,
+            "ranked": ranked,
+            "p_at_k": precision_at_k(relevant_set, retrieved_results, k) if ranked else None,
+            "average_precision": average_precision(relevant_set, retrieved_results) if ranked else None,
+            "ndcg": ndcg_at_k(relevant_set, retrieved_results, k) if ranked else None,
+        }
+
+    def execute(self, session, query, parameters):
+        # Run a query and return its unique content ids in result order, with the time it took
+        start = time.perf_counter()
+        result = session.run(query, parameters)
+        retrieved_ids = dedupe(record["content_id"] for record in result)
+        return retrieved_ids, time.perf_counter() - start
+
     def run_query(self, term, query):
-        with self.driver.session() as session:
-            if "cat.name = $category" in query:
-                # For queries that use the 'category' parameter
-                print(f"Running query for category '{term}' with query:\n{query}")
-                result = session.run(query, category=term)
-            else:
-                # For queries that use the 'term' parameter
-                print(f"Running query for term '{term}' with query:\n{query}")
-                result = session.run(query, term=term)
-                
-            retrieved_ids = [record["content_id"] for record in result]
-            print(f"Retrieved IDs for '{term}': {retrieved_ids}")
+        with self.session() as session:
+            retrieved_ids, elapsed = self.execute(session, query, infer_parameters(query, term))
             return retrieved_ids
 
-    def run_tests(self, golden_queries, cypher_queries):
-        results = defaultdict(dict)
-        
-        for term, expected_ids in golden_queries.items():
-            # Use the appropriate query from the YAML file
-            if term not in cypher_queries:
+    def run_batch(self, batch):
+        # Run a batch of (term, query) pairs in one session, each repeat times
+        repeat = max(1, int(self.settings["repeat"]))
+        output = []
+        with self.session() as session:
+            for term, query in batch:
+                parameters = infer_parameters(query, term)
+                latencies = []
+                try:
+                    for i in range(repeat):
+                        retrieved_ids, elapsed = self.execute(session, query, parameters)
+                        latencies.append(elapsed)
+                    output.append((term, retrieved_ids, latencies, None))
+                except Exception as e:
+                    output.append((term, [], latencies, str(e)))
+        return output
+
+    def profile_batch(self, batch):
+        # Run a batch of (term, query) pairs under PROFILE or EXPLAIN and keep the plans
+        mode = self.settings["profile"]
+        output = []
+        with self.session() as session:
+            for term, query in batch:
+                parameters = infer_parameters(query, term)
+                try:
+                    summary = session.run(f"{mode.upper()} {query}", parameters).consume()
+                    plan = summary.profile if mode == "profile" else summary.plan
+                    profile = summarize_plan(plan or {}, mode == "profile")
+                    output.append((term, dict(profile, query=query, parameters=parameters), None))
+                except Exception as e:
+                    output.append((term, {"query": query, "parameters": parameters}, str(e)))
+        return output
+
+    def run_batches(self, pairs, work):
+        # Run work on batches of (term, query) pairs on the thread pool and yield its results
+        size = max(1, int(self.settings["batch"]))
+        batches = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+        with ThreadPoolExecutor(max_workers=max(1, int(self.settings["workers"]))) as executor:
+            futures = [executor.submit(work, batch) for batch in batches]
+            for done, future in enumerate(as_completed(futures), start=1):
+                yield from future.result()
+                print(f"{done} of {len(batches)} query batches done.")
+
+    def resolve_queries(self, golden_queries, cypher_queries, templates=None):
+        # Pair each golden query with its Cypher, which can be a query or a template name
+        templates = templates or {}
+        default = self.settings.get("template")
+        pairs = []
+        for term in golden_queries:
+            query = cypher_queries.get(term, default)
+            if query is None:
                 print(f"Warning: No Cypher query provided for term '{term}'. Skipping.")
                 continue
+            pairs.append((term, templates.get(query, query)))
+        return pairs
 
-            # Execute the query for the current term
-            retrieved_ids = self.run_query(term, cypher_queries[term])
-            
-            # Calculate precision, recall, and F-score
-            precision, recall, f_score = self.calculate_f_score(expected_ids, retrieved_ids)
-            results[term] = {
-                "precision": precision,
-                "recall": recall,
-                "f_score": f_score,
-            }
-        
-        return results
-
-    def generate_report(self, results):
-        with open("output/f_score_report.txt", "w") as f:
+    def run_tests(self, golden_queries, cypher_queries, templates=None):
+        results = defaultdict(dict)
+        pairs = self.resolve_queries(golden_queries, cypher_queries, templates)
+        ranked = {term: is_ranked(query) for term, query in pairs}
+        for term, query in pairs:
+            if not ranked[term]:
+                print(f"Warning: Query for '{term}' has no ORDER BY. Its ranking scores are not reported.")
+        for term, retrieved_ids, latencies, error in self.run_batches(pairs, self.run_batch):
+            if error:
+                print(f"Error running query for '{term}': {error}")
+            metrics = self.calculate_metrics(golden_queries[term], retrieved_ids, ranked[term])
+            metrics["retrieved"] = len(retrieved_ids)
+            metrics["latencies"] = latencies
+            metrics["latency"] = latency_stats(latencies)
+            if error:
+                metrics["error"] = error
+            results[term] = metrics
+
+        # Keep the order of the golden queries in the report
+        return {term: results[term] for term, query in pairs if term in results}
+
+    def profile_queries(self, golden_queries, cypher_queries, templates=None):
+        # Plan each query under the profile mode, in the order of the golden queries
+        pairs = self.resolve_queries(golden_queries, cypher_queries, templates)
+        profiles = {}
+        for term, profile, error in self.run_batches(pairs, self.profile_batch):
+            if error:
+                print(f"Error profiling query for '{term}': {error}")
+                profile["error"] = error
+            elif profile["full_scan"]:
+                print(f"Warning: Query for '{term}' does a full scan: {', '.join(profile['scans'])}")
+            profiles[term] = profile
+        return {term: profiles[term] for term, query in pairs if term in profiles}
+
+    def generate_profile(self, profiles, path="output/query_profile.json"):
+        flagged = sorted(term for term, p in profiles.items() if p.get("full_scan"))
+        report = {
+            "mode": self.settings["profile"],
+            "queries": len(profiles),
+            "full_scans": flagged,
+            "profiles": profiles,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        return report
+
+    def summarize(self, results):
+        # Mean quality scores and latency percentiles over every run of every query
+        # Ranking scores are averaged over the queries with an ORDER BY only
+        count = len(results)
+        ranked = [m for m in results.values() if m["ranked"]]
+        summary = {"queries": count, "ranked": len(ranked), "k": self.settings["k"],
+                   "repeat": self.settings["repeat"]}
+        summary["mean_f_score"] = sum(m["f_score"] for m in results.values()) / count if count else 0.0
+        for name, key in (("mean_p_at_k", "p_at_k"), ("map", "average_precision"), ("mean_ndcg", "ndcg")):
+            summary[name] = sum(m[key] for m in ranked) / len(ranked) if ranked else None
+        summary["latency"] = latency_stats([l for m in results.values() for l in m["latencies"]])
+        summary["errors"] = sum(1 for m in results.values() if m.get("error"))
+        return summary
+
+    def generate_report(self, results, path="output/f_score_report.txt"):
+        summary = self.summarize(results)
+        k = summary["k"]
+        with open(path, "w") as f:
             f.write("F-Score Report for Information Retrieval System\n\n")
+            f.write(f"Queries: {summary['queries']}  Ranked: {summary['ranked']}  "
+                    f"Runs per query: {summary['repeat']}  Errors: {summary['errors']}\n")
+            f.write(f"  Mean F-Score: {summary['mean_f_score']:.2f}\n")
+            f.write(f"  Mean P@{k}: {format_score(summary['mean_p_at_k'])}\n")
+            f.write(f"  MAP: {format_score(summary['map'])}\n")
+            f.write(f"  Mean nDCG@{k}: {format_score(summary['mean_ndcg'])}\n")
+            latency = summary["latency"]
+            f.write(f"  Latency ms p50: {latency['p50']:.1f} p95: {latency['p95']:.1f} "
+                    f"p99: {latency['p99']:.1f} max: {latency['max']:.1f}\n\n")
             for term, metrics in results.items():
                 f.write(f"Term: {term}\n")
                 f.write(f"  Precision: {metrics['precision']:.2f}\n")
                 f.write(f"  Recall: {metrics['recall']:.2f}\n")
-                f.write(f"  F-Score: {metrics['f_score']:.2f}\n\n")
+                f.write(f"  F-Score: {metrics['f_score']:.2f}\n")
+                f.write(f"  P@{k}: {format_score(metrics['p_at_k'])}\n")
+                f.write(f"  Average Precision: {format_score(metrics['average_precision'])}\n")
+                f.write(f"  nDCG@{k}: {format_score(metrics['ndcg'])}\n")
+                latency = metrics["latency"]
+                f.write(f"  Latency ms p50: {latency['p50']:.1f} p95: {latency['p95']:.1f} max: {latency['max']:.1f}\n")
+                if metrics.get("error"):
+                    f.write(f"  Error: {metrics['error']}\n")
+                f.write("\n")
 
-# Main execution
-if __name__ == "__main__":
+        with open(path.rsplit(".", 1)[0] + ".json", "w") as f:
+            terms = {term: {k: v for k, v in m.items() if k != "latencies"} for term, m in results.items()}
+            json.dump({"summary": summary, "terms": terms}, f, indent=1)
+        return summary
+
+def main(queries_path="queries.yml", workers=None, repeat=None, profile=None, backend=None):
     # Load the YAML configuration
-    with open("queries.yml", "r") as stream:
+    with open(queries_path, "r") as stream:
         config = yaml.safe_load(stream)
 
-    # Extract Neo4j connection details and queries
-    cypher_queries = config["queries"]
+    # Extract the queries, the optional templates, and the run settings
+    cypher_queries = config.get("queries") or {}
     golden_queries = config["golden_queries"]
+    templates = config.get("templates") or {}
+
+    settings = dict(config.get("settings") or {})
+    if workers:
+        settings["workers"] = workers
+    if repeat:
+        settings["repeat"] = repeat
+    if profile:
+        settings["profile"] = profile
+    if backend:
+        settings["backend"] = backend
+    if settings.get("profile") and settings["profile"] not in PROFILE_MODES:
+        print(f"Error: profile must be one of {', '.join(PROFILE_MODES)}.")
+        return
+    if settings.get("profile") and settings.get("backend") == "memory":
+        print("Error: profiling needs the neo4j backend.")
+        return
 
     # Create an FScoreCalculator instance
-    f_score_calculator = FScoreCalculator()
-    
+    f_score_calculator = FScoreCalculator(settings)
+
     try:
         # Run the tests and generate the report
-        results = f_score_calculator.run_tests(golden_queries, cypher_queries)
+        results = f_score_calculator.run_tests(golden_queries, cypher_queries, templates)
         f_score_calculator.generate_report(results)
-        print("F-Score report generated: f_score_report.txt")
+        print("F-Score report generated: output/f_score_report.txt")
+        if f_score_calculator.settings["profile"]:
+            profiles = f_score_calculator.profile_queries(golden_queries, cypher_queries, templates)
+            f_score_calculator.generate_profile(profiles)
+            print("Query profile generated: output/query_profile.json")
     finally:
         # Close the connection to Neo4j
         f_score_calculator.close()
+
+# Main execution
+if __name__ == "__main__":
+    main()
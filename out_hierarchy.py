@@ -1,96 +1,142 @@
-import yaml
-from neo4j import GraphDatabase
+'''
+Writes the category hierarchy under a root category.
+
+The categories under the root are fetched as a flat list, one record per
+category with the ids of its children and the names of its terms, in one
+streaming query. The tree is built from the list in one pass and written
+with an explicit stack, so deep taxonomies don't hit the recursion limit.
+
+The output format is text, JSON, or indented CSV, where each row is
+indented by one empty cell per level. It is picked from the file extension
+unless it is given.
+
+'''
+
+import csv
+import json
+
+import neoconnect as NC
+
+HIERARCHY_QUERY = """
+MATCH (:Category {id: $root_id})-[:HAS_CHILD*0..]->(category:Category)
+WITH DISTINCT category
+RETURN category.id AS id, category.name AS name,
+       [(category)-[:HAS_CHILD]->(child:Category) | child.id] AS children,
+       [(category)-[:HAS_TERM]->(term:Term) | term.name] AS terms
+"""
+
+
+def get_format(output_file, output_format=None):
+    '''Return the output format, from the file extension if it isn't given.'''
+    if output_format:
+        return output_format
+    extension = output_file.rsplit(".", 1)[-1].lower()
+    return extension if extension in ("json", "csv") else "text"
+
+
+def walk(nodes, root_id):
+    '''Yield (event, node, level) for the tree under root_id in depth-first
+    order, where event is "enter" or "exit". A node reached a second time,
+    by a cycle or a second parent, is skipped.'''
+    visited = {root_id}
+    stack = [(nodes[root_id], 0, False)]
+    while stack:
+        node, level, done = stack.pop()
+        if done:
+            yield "exit", node, level
+            continue
+        yield "enter", node, level
+        stack.append((node, level, True))
+        for child_id in reversed(node["children"]):
+            if child_id in nodes and child_id not in visited:
+                visited.add(child_id)
+                stack.append((nodes[child_id], level + 1, False))
+
 
 class Neo4jQuery:
     def __init__(self):
-        with open("working/fowler.yml", "r") as stream:
-          neocred = yaml.safe_load(stream)
-        self.driver = GraphDatabase.driver(neocred["domain"], auth=(neocred["username"],  neocred["password"]))
+        self.driver = NC.get_driver()
 
     def close(self):
-        self.driver.close()
-
-    def get_hierarchy(self, root_id, output_file):
-        with self.driver.session() as session:
-            result = session.run(
-                """
-                MATCH (root:Category {id: $root_id})-[r:HAS_CHILD*]->(category:Category)
-                OPTIONAL MATCH (category)-[t:HAS_TERM]->(term:Term)
-                RETURN root, category, term, r, t;
-                """,
-                root_id=root_id
-            )
-            
-            # Process the result and build the hierarchy
-            nodes = {}
-            relationships = []
-            for record in result:
-                root = record["root"]
-                category = record["category"]
-                term = record["term"]
-                category_rels = record["r"]  # category_rels will be a list for variable-length paths
-                term_rel = record["t"]
-                
-                # Build a node dictionary based on the category ids
-                if root["id"] not in nodes:
-                    nodes[root["id"]] = {
-                        "name": root["name"],
-                        "id": root["id"],
-                        "children": [],
-                        "terms": []
-                    }
-                if category and category["id"] not in nodes:
-                    nodes[category["id"]] = {
-                        "name": category["name"],
-                        "id": category["id"],
-                        "children": [],
-                        "terms": []
-                    }
-                
-                # Add relationships for each category path
-                for rel in category_rels:
-                    relationships.append((rel.start_node["id"], rel.end_node["id"]))
-                
-                # Add term if exists
-                if term:
-                    nodes[category["id"]]["terms"].append(term["name"])
-
-            # Build the hierarchy by linking the nodes based on relationships
-            for start_id, end_id in relationships:
-                nodes[start_id]["children"].append(nodes[end_id])
-
-            # Write the hierarchy to a file with UTF-8 encoding
-            with open(output_file, 'w', encoding='utf-8') as file:
-                visited = set()  # Track visited nodes to prevent cycles
-                self.write_hierarchy(nodes[root["id"]], 0, file, visited)
-
-    def write_hierarchy(self, node, level, file, visited):
-        if node['id'] in visited:
-            return  # Prevent infinite recursion by skipping already visited nodes
-        visited.add(node['id'])
-
-        indent = "│   " * level
-        if level == 0:
-            file.write(f"Root Term: {node['name']}\n")
-        else:
-            file.write(f"{indent}├── Subcategory: {node['name']}\n")
-
-        # Write terms
-        for term in node['terms']:
-            file.write(f"{indent}│   └── Term: {term}\n")
-
-        # Recursively write subcategories
-        for child in node['children']:
-            self.write_hierarchy(child, level + 1, file, visited)
+        NC.close()
 
-# Usage
-if __name__ == "__main__":
-    root_id = "7756ccb1-300c-417b-83d4-0ddfa585005c"  # Replace with your root category ID
-    output_file = "C:\\git\\feature\\information-retrieval-graph-poc\\output\\hierarchy_output.txt"  # Path to the output file
+    def get_nodes(self, root_id):
+        # Build the category dictionary from the edge list, one record per category
+        nodes = {}
+        with NC.session() as session:
+            for record in session.run(HIERARCHY_QUERY, root_id=root_id):
+                nodes[record["id"]] = {
+                    "name": record["name"],
+                    "id": record["id"],
+                    "children": sorted(set(record["children"])),
+                    "terms": sorted(set(t for t in record["terms"] if t is not None)),
+                }
+        return nodes
+
+    def get_hierarchy(self, root_id, output_file, output_format=None):
+        nodes = self.get_nodes(root_id)
+        if root_id not in nodes:
+            print(f"Error: No category with id {root_id}.")
+            return False
+
+        writers = {"text": self.write_text, "json": self.write_json, "csv": self.write_csv}
+        output_format = get_format(output_file, output_format)
+        # Write the hierarchy to a file with UTF-8 encoding
+        with open(output_file, 'w', encoding='utf-8', newline="" if output_format == "csv" else None) as file:
+            writers[output_format](nodes, root_id, file)
+        return True
+
+    def write_text(self, nodes, root_id, file):
+        for event, node, level in walk(nodes, root_id):
+            if event == "exit":
+                continue
+            indent = "│   " * level
+            if level == 0:
+                file.write(f"Root Term: {node['name']}\n")
+            else:
+                file.write(f"{indent}├── Subcategory: {node['name']}\n")
+
+            # Write terms
+            for term in node['terms']:
+                file.write(f"{indent}│   └── Term: {term}\n")
+
+    def write_json(self, nodes, root_id, file):
+        # Write the nested object a node at a time, closing each one on exit
+        first = True
+        for event, node, level in walk(nodes, root_id):
+            if event == "exit":
+                file.write("]}")
+                first = False
+                continue
+            if not first:
+                file.write(",")
+            file.write('{{"id": {}, "name": {}, "terms": {}, "children": ['.format(
+                json.dumps(node["id"]), json.dumps(node["name"]), json.dumps(node["terms"])))
+            first = True
+        file.write("\n")
+
+    def write_csv(self, nodes, root_id, file):
+        writer = csv.writer(file)
+        writer.writerow(["type", "id", "level", "name"])
+        for event, node, level in walk(nodes, root_id):
+            if event == "exit":
+                continue
+            kind = "root" if level == 0 else "category"
+            writer.writerow([kind, node["id"], level] + [""] * level + [node["name"]])
+            for term in node["terms"]:
+                writer.writerow(["term", "", level + 1] + [""] * (level + 1) + [term])
 
+
+def main(root_id, output_file="output/hierarchy_output.txt", output_format=None):
     neo4j_query = Neo4jQuery()
     try:
-        neo4j_query.get_hierarchy(root_id, output_file)
-        print(f"Hierarchy exported to {output_file}")
+        if neo4j_query.get_hierarchy(root_id, output_file, output_format):
+            print(f"Hierarchy exported to {output_file}")
     finally:
         neo4j_query.close()
+
+# Usage
+if __name__ == "__main__":
+    root_id = "7756ccb1-300c-417b-83d4-0ddfa585005c"  # Replace with your root category ID
+    output_file = "C:\\git\\feature\\information-retrieval-graph-poc\\output\\hierarchy_output.txt"  # Path to the output file
+    main(root_id, output_file)
@@ -0,0 +1,126 @@
+'''
+Leaf category centroids for incremental taxonomy updates.
+
+The store keeps, for each leaf category of the taxonomy, the sum of the
+hashed vectors of its terms, the number of terms, and the category id and
+name. Because the terms are vectorized with the stateless hashing
+vectorizer from `termstream`, new terms land in the same space as the terms
+the taxonomy was built from, and each one can be placed in its nearest
+leaf with one sparse product instead of clustering everything again.
+
+The sums have N_FEATURES columns, so a leaf row holds at most 4,096 values
+however large the vocabulary gets, and in practice one value for each
+distinct word of the leaf's terms. The store grows with the number of
+leaves, not the vocabulary. New terms are compared to the leaves in blocks
+of ASSIGN_BLOCK terms, so the similarity matrix is at most ASSIGN_BLOCK x
+leaves.
+
+The store is saved as a NumPy .npz file. A store saved with a different
+N_FEATURES has to be built again.
+
+'''
+
+import os
+
+import numpy as np
+from scipy import sparse
+
+import termstream as TS
+
+CENTROIDS_PATH = "working/centroids.npz"
+ASSIGN_BLOCK = 1000
+
+
+class CentroidStore:
+
+    def __init__(self, sums=None, counts=None, ids=None, names=None):
+        '''sums is a sparse matrix with a row per leaf, counts the number of
+        terms in each leaf, and ids and names the leaf categories.'''
+        self.sums = sums if sums is not None else sparse.csr_matrix((0, TS.N_FEATURES))
+        self.counts = np.asarray(counts if counts is not None else [], dtype=np.int64)
+        self.ids = list(ids or [])
+        self.names = list(names or [])
+        self.pending = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path=CENTROIDS_PATH):
+        '''Load a store from an .npz file.'''
+        with np.load(path) as data:
+            sums = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+            return cls(sums, data["counts"], data["ids"].tolist(), data["names"].tolist())
+
+    def save(self, path=CENTROIDS_PATH):
+        '''Write the store to an .npz file.'''
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        sums = self.matrix()
+        temp = path + ".tmp.npz"
+        np.savez_compressed(temp, data=sums.data, indices=sums.indices, indptr=sums.indptr,
+                            shape=np.array(sums.shape), counts=self.counts,
+                            ids=np.array(self.ids, dtype=str), names=np.array(self.names, dtype=str))
+        os.replace(temp, path)
+
+    def compatible(self):
+        '''True if the store was built with the current vectorizer width.'''
+        return self.sums.shape[1] == TS.N_FEATURES
+
+    def matrix(self):
+        '''Return the sums matrix with any pending leaves added.'''
+        if self.pending:
+            self.sums = sparse.vstack([self.sums] + self.pending, format="csr")
+            self.pending = []
+        return self.sums
+
+    def add_leaves(self, ids, names, groups, vectors):
+        '''Add leaves. groups holds the row numbers in vectors of the terms of
+        each leaf.'''
+        rows = []
+        cols = []
+        for row, group in enumerate(groups):
+            rows.extend([row] * len(group))
+            cols.extend(group)
+        membership = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(groups), vectors.shape[0]))
+        self.pending.append((membership @ vectors).tocsr())
+        self.counts = np.concatenate([self.counts, [len(g) for g in groups]]).astype(np.int64)
+        self.ids.extend(ids)
+        self.names.extend(names)
+
+    def assign(self, vectors):
+        '''Return the index of the nearest leaf by cosine similarity for each
+        row of vectors.'''
+        from sklearn.preprocessing import normalize
+
+        centroids = normalize(self.matrix()).T.tocsc()
+        nearest = []
+        for start in range(0, vectors.shape[0], ASSIGN_BLOCK):
+            similarity = vectors[start:start + ASSIGN_BLOCK] @ centroids
+            nearest.append(np.asarray(similarity.argmax(axis=1)).ravel())
+        return np.concatenate(nearest) if nearest else np.zeros(0, dtype=np.int64)
+
+    def add_terms(self, leaves, vectors):
+        '''Add the rows of vectors to the leaves they were assigned to.'''
+        sums = self.matrix()
+        membership = sparse.csr_matrix((np.ones(len(leaves)), (leaves, np.arange(len(leaves)))),
+                                       shape=(sums.shape[0], vectors.shape[0]))
+        self.sums = (sums + membership @ vectors).tocsr()
+        self.counts += np.bincount(leaves, minlength=len(self.counts))
+
+    def remove(self, leaves):
+        '''Remove leaves by index.'''
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[list(leaves)] = False
+        self.sums = self.matrix()[np.flatnonzero(keep)]
+        self.counts = self.counts[keep]
+        self.ids = [i for i, k in zip(self.ids, keep) if k]
+        self.names = [n for n, k in zip(self.names, keep) if k]
+
+
+def main():
+    print("This module contains the leaf centroid store for incremental taxonomy updates.")
+
+if __name__ == "__main__":
+    main()
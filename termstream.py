@@ -0,0 +1,156 @@
+'''
+Streaming partition of large term sets for the taxonomy.
+
+Terms are vectorized with a `HashingVectorizer` into N_FEATURES columns,
+which keeps no vocabulary. They are projected to DIMENSIONS dense columns
+with a truncated SVD and split into clusters with `MiniBatchKMeans`, which
+on the sparse vectors leaves most terms in one cluster. The terms are read
+once from Neo4j into a spill file. Each time a group is spilled, a random
+sample of FIT_SAMPLE of its terms is kept, and the projection and clusters
+of the group are fit on that sample. One pass over the group's
+file then spills each term to the file of its cluster. Clusters that are
+still larger than `LEAF_SIZE` are partitioned again from their files, and
+the exact clustering in `termtree` only runs on the small leaf groups.
+
+Memory doesn't depend on the number of terms:
+
+- the projection, DIMENSIONS x N_FEATURES float64 values, or 2.1 MB, and
+  the cluster centers, at most MAX_FANOUT x DIMENSIONS values
+- a chunk of CHUNK_SIZE terms and their sparse vectors
+- the fit samples of the groups waiting to be partitioned, at most
+  FIT_SAMPLE terms for each of MAX_FANOUT groups on each level
+
+'''
+
+import os
+import json
+import random
+
+N_FEATURES = 2 ** 12
+CHUNK_SIZE = 10000
+FIT_SAMPLE = 2000
+DIMENSIONS = 64
+LEAF_SIZE = 5000
+MAX_FANOUT = 100
+SAMPLE_TERMS = 50
+MAX_SHARE = 0.9
+SPILL_DIR = "working"
+
+
+def get_vectorizer():
+    '''Return the stateless vectorizer used for every chunk.'''
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, stop_words="english", norm="l2")
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    '''Yield lists of at most chunk_size terms from a spill file.'''
+    chunk = []
+    with open(path, "r", encoding="utf-8") as stream:
+        for line in stream:
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class Partition:
+
+    def __init__(self, path):
+        '''A cluster of terms spilled to the file at path.'''
+        self.path = path
+        self.count = 0
+        self.sample = []
+
+    def add(self, term, rng):
+        '''Count a term and keep it in a fixed size random sample for
+        fitting the clusters and naming.'''
+        self.count += 1
+        if len(self.sample) < FIT_SAMPLE:
+            self.sample.append(term)
+        else:
+            slot = rng.randrange(self.count)
+            if slot < FIT_SAMPLE:
+                self.sample[slot] = term
+
+    def naming_sample(self, seed=0):
+        '''Return a random sample of SAMPLE_TERMS terms to name the cluster by.'''
+        if len(self.sample) <= SAMPLE_TERMS:
+            return list(self.sample)
+        return random.Random(seed).sample(self.sample, SAMPLE_TERMS)
+
+    def reader(self):
+        '''Return an iterator over the chunks of terms in the spill file.'''
+        return read_chunks(self.path)
+
+
+def get_cluster_count(count):
+    '''Return the number of clusters for a group of count terms.'''
+    return min(MAX_FANOUT, max(2, -(-count // LEAF_SIZE)))
+
+
+def spill(chunks, assign, folder, prefix, seed=0):
+    '''Write each term to the file of the cluster assign(chunk) gives it.
+    Returns the non-empty partitions.'''
+    rng = random.Random(seed)
+    partitions = {}
+    files = {}
+    try:
+        for chunk in chunks:
+            for term, label in zip(chunk, assign(chunk)):
+                label = int(label)
+                if label not in partitions:
+                    partitions[label] = Partition(os.path.join(folder, "{}-{}.jsonl".format(prefix, label)))
+                    files[label] = open(partitions[label].path, "w", encoding="utf-8")
+                files[label].write(json.dumps(term) + "\n")
+                partitions[label].add(term, rng)
+    finally:
+        for stream in files.values():
+            stream.close()
+    return [partitions[label] for label in sorted(partitions)]
+
+
+def partition(part, folder, prefix, vectorizer=None, seed=0):
+    '''Split the terms of a spilled partition into about count / LEAF_SIZE
+    spill files. The clusters are fit on the sample of the partition and the
+    file is read once to assign the terms. If the clusters don't split the
+    terms, leaving more than MAX_SHARE of them in one cluster, the file is
+    read again and split in read order.'''
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import Normalizer
+
+    vectorizer = vectorizer or get_vectorizer()
+    clusters = get_cluster_count(part.count)
+    if len(part.sample) >= clusters:
+        model = make_pipeline(
+            TruncatedSVD(n_components=min(DIMENSIONS, len(part.sample) - 1), random_state=seed),
+            Normalizer(),
+            MiniBatchKMeans(n_clusters=clusters, random_state=seed, n_init=3,
+                            batch_size=min(CHUNK_SIZE, len(part.sample))))
+        model.fit(vectorizer.transform(part.sample))
+        parts = spill(part.reader(), lambda chunk: model.predict(vectorizer.transform(chunk)), folder, prefix, seed)
+        if max(p.count for p in parts) <= MAX_SHARE * part.count:
+            return parts
+        for empty in parts:
+            os.remove(empty.path)
+
+    position = [0]
+
+    def in_order(chunk):
+        labels = [(position[0] + i) // LEAF_SIZE for i in range(len(chunk))]
+        position[0] += len(chunk)
+        return labels
+
+    return spill(part.reader(), in_order, folder, prefix, seed)
+
+
+def main():
+    print("This module contains the streaming term partition for the taxonomy.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''
+Hierarchical clustering tree for the term taxonomy.
+
+The TF-IDF matrix of the terms is reduced with a truncated SVD, which works
+on the sparse matrix directly, and the rows are normalized so Euclidean
+distance follows cosine similarity. One Ward tree is then built over the
+reduced vectors with a k-nearest-neighbor connectivity graph, which keeps
+the memory linear in the number of terms instead of quadratic. The
+taxonomy is cut from this one tree instead of clustering again at every
+level.
+
+'''
+
+import heapq
+
+import numpy as np
+
+COMPONENTS = 100
+NEIGHBORS = 10
+
+
+def reduce_terms(tfidf_matrix, components=COMPONENTS):
+    '''With a sparse TF-IDF matrix, return a dense matrix with at most
+    components columns and unit length rows.'''
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+
+    rows, columns = tfidf_matrix.shape
+    components = min(components, columns - 1, rows - 1)
+    if components < 2:
+        reduced = tfidf_matrix.toarray()
+    else:
+        reduced = TruncatedSVD(n_components=components, random_state=0).fit_transform(tfidf_matrix)
+    return normalize(reduced)
+
+
+def build_tree(vectors, neighbors=NEIGHBORS):
+    '''Build the Ward tree over the rows of vectors. Returns a TermTree.'''
+    from sklearn.cluster import AgglomerativeClustering
+    from sklearn.neighbors import kneighbors_graph
+
+    count = vectors.shape[0]
+    if count < 2:
+        return TermTree(np.empty((0, 2), dtype=np.intp), count)
+    connectivity = None
+    if count > neighbors + 1:
+        connectivity = kneighbors_graph(vectors, n_neighbors=neighbors, include_self=False)
+    clustering = AgglomerativeClustering(n_clusters=1, linkage="ward", connectivity=connectivity,
+                                         compute_full_tree=True)
+    clustering.fit(vectors)
+    return TermTree(clustering.children_, count)
+
+
+class TermTree:
+
+    def __init__(self, children, count):
+        '''children is the merge table from AgglomerativeClustering: row i
+        merges two nodes into node count + i. Nodes below count are terms.'''
+        self.children = np.asarray(children)
+        self.count = count
+        self.sizes = np.ones(count + len(self.children), dtype=np.intp)
+        for i, (a, b) in enumerate(self.children):
+            self.sizes[count + i] = self.sizes[a] + self.sizes[b]
+
+    @property
+    def root(self):
+        '''The node that holds all of the terms.'''
+        return self.count + len(self.children) - 1
+
+    def size(self, node):
+        '''Return the number of terms under a node.'''
+        return int(self.sizes[node])
+
+    def leaves(self, node):
+        '''Return the term indexes under a node, in ascending order.'''
+        found = []
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if item < self.count:
+                found.append(item)
+            else:
+                stack.extend(self.children[item - self.count])
+        return sorted(found)
+
+    def split(self, node, clusters):
+        '''Cut the subtree under node into up to clusters nodes by undoing its
+        last merges, the same as cutting the tree at that many clusters.'''
+        heap = [(-node, node)]
+        done = []
+        while heap and len(heap) + len(done) < clusters:
+            item = heapq.heappop(heap)[1]
+            if item < self.count:
+                done.append(item)
+                continue
+            for child in self.children[item - self.count]:
+                heapq.heappush(heap, (-int(child), int(child)))
+        return done + [item for key, item in heap]
+
+
+def main():
+    print("This module contains the hierarchical clustering tree for the taxonomy.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+'''
+Persistent cache for per-page keywords and summaries.
+
+Entries are keyed by a hash of the page text plus the name, version, and
+parameters of the extractor that produced them, so a page only has to be
+processed again when its text or the extractor changes. The cache is a
+SQLite file so it can be shared by the tocgrapher worker processes, and it
+evicts the least recently used entries once it grows past `max_mb`. Within a
+process, the connection is shared by threads behind a lock, since
+`tocscanner.stream_tocfile` reads the pages on its producer thread.
+
+'''
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+EVICT_EVERY = 256
+EVICT_TO = 0.9
+
+
+def hash_text(intext):
+    '''Return the SHA-256 hex digest of a text string.'''
+    return hashlib.sha256(intext.encode("utf-8")).hexdigest()
+
+
+def make_key(name, version, params, content_hash):
+    '''Build a cache key from an extractor description and a content hash.'''
+    return "{}:{}:{}:{}".format(name, version, json.dumps(params, sort_keys=True), content_hash)
+
+
+class TextCache:
+
+    def __init__(self, path, max_mb=512):
+        '''Open or create the cache file at path.'''
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.puts = 0
+
+    def get(self, key):
+        '''Return the cached value for key or None.'''
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        '''Store a JSON serializable value for key.'''
+        body = json.dumps(value)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, value, size, used) VALUES (?, ?, ?, ?)",
+                              (key, body, len(body), time.time()))
+            self.puts += 1
+            if self.puts % EVICT_EVERY == 0:
+                self.evict()
+
+    def get_or_compute(self, key, func, *args):
+        '''Return the cached value for key, or call func(*args) and cache it.
+        Results that are not lists or strings (such as error dicts) are not cached.'''
+        value = self.get(key)
+        if value is None:
+            value = func(*args)
+            if isinstance(value, (list, str)):
+                self.put(key, value)
+        return value
+
+    def size(self):
+        '''Return the number of entries and the total size of the values in bytes.'''
+        with self.lock:
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return count, total
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache is under its size limit.'''
+        with self.lock:
+            count, total = self.size()
+            if total <= self.max_bytes:
+                return 0
+            target = total - int(self.max_bytes * EVICT_TO)
+            freed = 0
+            keys = []
+            for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY used"):
+                if freed >= target:
+                    break
+                keys.append((key,))
+                freed += size
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            self.evictions += len(keys)
+            return len(keys)
+
+
+    def stats(self):
+        '''Return the hit, miss, and eviction counters for this process.'''
+        return {"cache_hits": self.hits, "cache_misses": self.misses, "cache_evictions": self.evictions}
+
+    def close(self):
+        with self.lock:
+            self.evict()
+            self.conn.close()
+
+
+def format_stats(stats):
+    '''Return a one line report of cache counters.'''
+    hits = stats.get("cache_hits", 0)
+    misses = stats.get("cache_misses", 0)
+    lookups = hits + misses
+    rate = 100.0 * hits / lookups if lookups else 0.0
+    return "Cache hits: {} misses: {} hit rate: {:.1f}% evictions: {}".format(
+        hits, misses, rate, stats.get("cache_evictions", 0))
+
+
+def main():
+    print("This module contains the persistent keyword and summary cache.")
+
+if __name__ == "__main__":
+    main()
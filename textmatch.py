@@ -0,0 +1,61 @@
+'''
+Multi-pattern matching for keyword scoring.
+
+`PatternMatcher` finds a list of terms in a text. When the optional
+`pyahocorasick` package is installed, the terms are compiled into its C
+Aho-Corasick automaton and every term is found in one pass over the text.
+Without it, each term is found with `str.count` and `in`, which is faster
+than an automaton written in Python at the sizes of a page and its keyword
+candidates. Counts follow `str.count` either way: occurrences of the same
+term don't overlap, while occurrences of different terms can.
+
+'''
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class PatternMatcher:
+
+    def __init__(self, patterns, automaton=None):
+        '''Index a list of non-empty string patterns. automaton picks the C
+        automaton (True) or str.count (False). By default the automaton is
+        used when pyahocorasick is installed.'''
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        if automaton is None:
+            automaton = ahocorasick is not None
+        self.automaton = None
+        if automaton and self.patterns:
+            self.automaton = ahocorasick.Automaton()
+            for index, pattern in enumerate(self.patterns):
+                self.automaton.add_word(pattern, (index, len(pattern)))
+            self.automaton.make_automaton()
+
+    def count(self, text):
+        '''Return a dict of pattern to the number of non-overlapping
+        occurrences in text, the same as `text.count(pattern)`.'''
+        if self.automaton is None:
+            return {p: text.count(p) for p in self.patterns}
+        counts = [0] * len(self.patterns)
+        last_end = [0] * len(self.patterns)
+        for end, (index, length) in self.automaton.iter(text):
+            # end is the position of the last character of the match
+            if end + 1 - length >= last_end[index]:
+                counts[index] += 1
+                last_end[index] = end + 1
+        return dict(zip(self.patterns, counts))
+
+    def present(self, text):
+        '''Return the set of patterns found in text.'''
+        if self.automaton is None:
+            return {p for p in self.patterns if p in text}
+        return {self.patterns[index] for end, (index, length) in self.automaton.iter(text)}
+
+
+def main():
+    print("This module contains the multi-pattern matcher used to score keywords.")
+
+if __name__ == "__main__":
+    main()
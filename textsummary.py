@@ -4,62 +4,103 @@
     Input: Ingests a file and get the summary.
     Output: a short summary.
 
+    Sentences are scored with a sparse sentence-term matrix: each row holds
+    the scored words of a sentence, and one matrix-vector product with the
+    word frequencies gives the score of every sentence.
+
 '''
 
 
 import re
 import html as HTML
 import nltk
-import heapq
+import numpy as np
+from scipy import sparse
+
+VERSION = "1.3"
+PARAMS = {"sentences": 7}
 
+STOPWORDS = None
 
-def get_summary_text(intext):
-    '''Script from Golkonda that summarizes a document.'''
 
-    # Removing Square Brackets and Extra Spaces
-    article_text = re.sub(r'\[[0-9]*\]', ' ', intext)
-    article_text = re.sub(r'\s+', ' ', article_text)
+def get_stopwords():
+    '''Return the English stopwords as a frozenset, loading them on first use.'''
+    global STOPWORDS
+    if STOPWORDS is None:
+        STOPWORDS = frozenset(nltk.corpus.stopwords.words('english'))
+    return STOPWORDS
 
-    # Removing special characters and digits
-    formatted_article_text = re.sub('[^a-zA-Z]', ' ', article_text )  
-    formatted_article_text = re.sub(r'\s+', ' ', formatted_article_text) 
 
-    sentence_list = nltk.sent_tokenize(article_text)
+def clean_text(text):
+    '''Remove reference brackets like [1] and collapse the whitespace in a text.'''
+    text = re.sub(r'\[[0-9]*\]', ' ', text)
+    return re.sub(r'\s+', ' ', text)
 
-    stopwords = nltk.corpus.stopwords.words('english')
 
-    word_frequencies = {}
+def count_words(article_text):
+    '''Return a dict of each word of the letters in the clean text to its
+    count, with the stopwords removed. Raises a ValueError if there are no
+    words.'''
+    formatted_article_text = re.sub('[^a-zA-Z]', ' ', article_text)
+    formatted_article_text = re.sub(r'\s+', ' ', formatted_article_text)
+    stopwords = get_stopwords()
+    counts = {}
     for word in nltk.word_tokenize(formatted_article_text):
         if word not in stopwords:
-            if word not in word_frequencies.keys():
-                word_frequencies[word] = 1
-            else:
-                word_frequencies[word] += 1
-
-    maximum_frequncy = max(word_frequencies.values())
-
-    for word in word_frequencies.keys():  
-        word_frequencies[word] = (word_frequencies[word]/maximum_frequncy)
-        
-    sentence_scores = {}  
-    for sent in sentence_list:  
+            counts[word] = counts.get(word, 0) + 1
+    if not counts:
+        raise ValueError("The document has no words to score.")
+    return counts
+
+
+def sentence_entries(article_text, vocab):
+    '''Return the unique sentences of the clean text that contain a scored word,
+    in order of their first scored occurrence, and the (row, column) pairs
+    of the scored words. Sentences of 30 or more words are skipped.'''
+    sentences = []
+    rows = {}
+    entries = []
+    for sent in nltk.sent_tokenize(article_text):
+        if len(sent.split(' ')) >= 30:
+            continue
         for word in nltk.word_tokenize(sent.lower()):
-            if word in word_frequencies.keys():
-                if len(sent.split(' ')) < 30:
-                    if sent not in sentence_scores.keys():
-                        sentence_scores[sent] = word_frequencies[word]
-                    else:
-                        sentence_scores[sent] += word_frequencies[word]
-    summary_sentences = heapq.nlargest(7, sentence_scores, key=sentence_scores.get)
-
-    summary = ' '.join(summary_sentences)
-    escaped = HTML.escape(summary, quote="True")
-
-    return escaped
+            col = vocab.get(word)
+            if col is None:
+                continue
+            row = rows.get(sent)
+            if row is None:
+                row = rows[sent] = len(sentences)
+                sentences.append(sent)
+            entries.append((row, col))
+    return sentences, entries
+
+
+def get_summary_text(intext, count=None):
+    '''Script from Golkonda that summarizes a document. Returns the count
+    highest scoring sentences, with ties in the order the sentences first
+    appear. Raises a ValueError if the document has no words.'''
+    count = PARAMS["sentences"] if count is None else count
+    article_text = clean_text(intext)
+    counts = count_words(article_text)
+    vocab = {word: i for i, word in enumerate(counts)}
+    sentences, entries = sentence_entries(article_text, vocab)
+    # Keep each row's entries in token order, without summing repeated words,
+    # so every score adds the same floats in the same order as summing the
+    # weights word by word. Ties then break the same way.
+    entries.sort(key=lambda entry: entry[0])
+    indptr = np.zeros(len(sentences) + 1, dtype=np.int64)
+    np.cumsum(np.bincount([row for row, col in entries], minlength=len(sentences)), out=indptr[1:])
+    matrix = sparse.csr_matrix((np.ones(len(entries)), [col for row, col in entries], indptr),
+                               shape=(len(sentences), len(vocab)))
+    maximum = max(counts.values())
+    scores = matrix @ np.array([c / maximum for c in counts.values()])
+    order = np.argsort(-scores, kind="stable")[:count]
+    summary = ' '.join(sentences[i] for i in order)
+    return HTML.escape(summary, quote="True")
 
 
 def main():
     print("This is the script that contains the functional logic.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
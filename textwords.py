@@ -13,13 +13,42 @@
 '''
 
 import html as HTML
+import heapq
 import nltk
-import pandas as pd
 import stoplist as SP
+import textmatch as TM
+
+VERSION = "1.5"
+PARAMS = {"top": 10}
+
+GRAMMAR = r"""
+    NBAR:
+        # Nouns and Adjectives, terminated with Nouns
+        {<NN.*>*<NN.*>}
+
+    NP:
+        {<NBAR>}
+        # Above, connected with in/of/etc...
+        {<NBAR><IN><NBAR>}
+    """
+
+TAGGER = None
+EXTRACTOR = None
 
 
 # Score algorithm 
 
+SEO_WEIGHTS = {
+    "title": 5,
+    "heading1": 5,
+    "description": 5,
+    "filename": 5,
+    "bodytitle": 3,
+    "intro": 3,
+    "imgtext": 2,
+    "imgfilename": 2
+}
+
 def make_SEO_dict(textcorpus):
     SEO_dict = {
         "title" : '',
@@ -86,26 +115,42 @@ def score_SEO(SEO_dict, instring):
 
     return score
 
+
+def score_terms(SEO_dict, bodytext, terms):
+    '''Return a dict of term to (SEO score, count) for a list of terms. Each
+    SEO field and the body text are scanned once for all of the terms, with
+    the same results as `score_SEO` and `bodytext.count`.'''
+    matcher = TM.PatternMatcher(terms)
+    scores = dict.fromkeys(matcher.patterns, 0)
+    for field, weight in SEO_WEIGHTS.items():
+        for term in matcher.present(SEO_dict[field]):
+            scores[term] += weight
+    counts = matcher.count(bodytext)
+    return {term: (scores[term], counts[term]) for term in matcher.patterns}
+
 # Parser Functions using NLTK
 
+def get_tagger():
+    '''Return the process-wide perceptron tagger, building it on first use.
+
+    `nltk.pos_tag` loads a new tagger model on every call, so the tagger is
+    held at module level and reused by `extract_chunks`.'''
+    global TAGGER
+    if TAGGER is None:
+        TAGGER = nltk.tag.PerceptronTagger()
+    return TAGGER
+
+
+def load_models():
+    '''Load the NLTK tokenizer, tagger, and stopword models into this process.'''
+    get_extractor().get_tagger()
+    nltk.sent_tokenize("Load the models.")
+    nltk.corpus.stopwords.words('english')
+
+
 def extract_chunks(sent):
     '''With a parsed sentence, return sets of entities.'''
-    grammar = r"""
-    NBAR:
-        # Nouns and Adjectives, terminated with Nouns
-        {<NN.*>*<NN.*>}
-
-    NP:
-        {<NBAR>}
-        # Above, connected with in/of/etc...
-        {<NBAR><IN><NBAR>}
-    """
-    chunker = nltk.RegexpParser(grammar)
-    ne = set()
-    chunk = chunker.parse(nltk.pos_tag(nltk.word_tokenize(sent)))
-    for tree in chunk.subtrees(filter=lambda t: t.label() == 'NP'):
-        ne.add(' '.join([child[0] for child in tree.leaves()]))
-    return ne
+    return get_extractor().chunk_tagged(get_tagger().tag(nltk.word_tokenize(sent)))
 
 
 def parse_sentences(incorpus):
@@ -134,9 +179,10 @@ def remove_blank(inlist):
     return noblank
 
 
-def apply_stoplist(inlist):
+def apply_stoplist(inlist, stoplist=None):
     '''Iterate over the list to remove stop items.'''
-    stoplist = SP.stoplist.split("\n")
+    if stoplist is None:
+        stoplist = get_extractor().stoplist
     outlist = []
     for i in inlist:
         if i not in stoplist:
@@ -154,6 +200,17 @@ def clean_keyword(inlist):
     return outlist
 
 
+def filter_entities(entities, stoplist=None):
+    '''Clean a list of raw entities and return the unique multiword entities
+    that are not in the stoplist.'''
+    step1_entities = clean_keyword(entities)
+    step2_entities = remove_blank(step1_entities)
+    step3_entities = set(step2_entities) # remove duplicates
+    step4_entities = only_word_pairs(list(step3_entities))
+    step5_entities = apply_stoplist(step4_entities, stoplist)
+    return step5_entities
+
+
 def extract_entities(bodytext):
     '''Take a multisentence text and return a list of unique entities.'''
     breakdown = parse_sentences(bodytext)
@@ -161,34 +218,78 @@ def extract_entities(bodytext):
     for sent in breakdown:
         for i in extract_chunks(sent):
             entities.append(i)
-    step1_entities = clean_keyword(entities)
-    step2_entities = remove_blank(step1_entities)
-    step3_entities = set(step2_entities) # remove duplicates
-    step4_entities = only_word_pairs(list(step3_entities))
-    step5_entities = apply_stoplist(step4_entities)
-    return step5_entities
+    return filter_entities(entities)
+
+
+def rank_keywords(bodytext, record_terms, top=None):
+    '''With the body text and its entities, return the top SEO ranked
+    keywords, ordered by SEO score and then count. Ties keep the order of
+    record_terms.'''
+    top = PARAMS["top"] if top is None else top
+    scores = score_terms(make_SEO_dict(bodytext), bodytext, record_terms)
+    ranked = heapq.nlargest(top, record_terms, key=scores.get)
+    return [HTML.escape(term) for term in ranked]
+
+
+class KeywordExtractor:
+    '''Reusable keyword extractor.
+
+    The chunk grammar and the stoplist are compiled once and reused for every
+    document.'''
+
+    def __init__(self, top=None, stoplist=None, tagger=None):
+        self.top = PARAMS["top"] if top is None else top
+        self.chunker = nltk.RegexpParser(GRAMMAR)
+        self.stoplist = frozenset((SP.stoplist if stoplist is None else stoplist).split("\n"))
+        self.tagger = tagger
+
+    def get_tagger(self):
+        '''Return the tagger for this extractor.'''
+        if self.tagger is None:
+            self.tagger = get_tagger()
+        return self.tagger
+
+    def chunk_tagged(self, tagged):
+        '''With a POS tagged sentence, return the set of noun phrases.'''
+        ne = set()
+        chunk = self.chunker.parse(tagged)
+        for tree in chunk.subtrees(filter=lambda t: t.label() == 'NP'):
+            ne.add(' '.join([child[0] for child in tree.leaves()]))
+        return ne
+
+    def tokenize(self, textcorpus):
+        '''Split a document into a list of tokenized sentences.'''
+        return [nltk.word_tokenize(sent) for sent in parse_sentences(textcorpus)]
+
+    def extract(self, textcorpus):
+        '''Return the top keywords for a document, or the error dict of
+        `error_result` if it can't be processed.'''
+        try:
+            entities = []
+            for tagged in self.get_tagger().tag_sents(self.tokenize(textcorpus)):
+                for i in self.chunk_tagged(tagged):
+                    entities.append(i)
+            return rank_keywords(textcorpus, filter_entities(entities, self.stoplist), self.top)
+        except Exception as e:
+            return error_result(e)
+
+
+def get_extractor():
+    '''Return the process-wide keyword extractor, building it on first use.'''
+    global EXTRACTOR
+    if EXTRACTOR is None:
+        EXTRACTOR = KeywordExtractor()
+    return EXTRACTOR
+
+
+def error_result(e):
+    '''Return the error dict for a document that can't be processed.'''
+    return {1: {"error": "Unable to process file.", "message": str(e)}}
 
 
 def get_top_ten(textcorpus):
-    '''With a path name to a markdown file return the top 10 SEO ranked keywords in the file as a dictionary.'''
-    try:
-        bodytext = textcorpus
-        seo_dict = make_SEO_dict(bodytext)
-        record_terms = extract_entities(bodytext)
-        pagedata = {"SEO score" : [], "Count" : [], "Keyword" : []}
-        for term in record_terms:
-            pagedata["SEO score"].append(score_SEO(seo_dict, term))
-            pagedata["Count"].append(bodytext.count(term))
-            pagedata["Keyword"].append(term)
-        SEO_df_full = pd.DataFrame(pagedata).sort_values(by=["SEO score", "Count"], ascending=False).reset_index()
-        SEO_summary = SEO_df_full.loc[0:9].to_dict()
-        SEO_out = []
-        for i in SEO_summary['index']:
-            SEO_out.append(HTML.escape(SEO_summary['Keyword'][i]))
-    except Exception as e:
-        SEO_out = {1: {"error": "Unable to process file.", "message": str(e)}}
-
-    return SEO_out
+    '''With the text of a markdown file, or its AnalyzedDocument, return the top 10 SEO ranked keywords in the file.'''
+    return get_extractor().extract(textcorpus)
 
 
 def main():
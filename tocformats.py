@@ -12,14 +12,14 @@ Each function produces the target output. Currently supporting:
 
 '''
 
+import os
+import csv
 import yaml
-from neo4j import GraphDatabase
+import time
+import uuid
 import logging
-from neo4j.exceptions import ServiceUnavailable
 
 import mdbutilities as MU
-import textsummary as SUM
-import textwords as LEX
 
 NODECOUNT = 1
 
@@ -34,6 +34,8 @@ def make_attribute(indict):
 class Neo4jDB:
 
     def __init__(self, uri, user, password):
+        from neo4j import GraphDatabase
+
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
 
     def close(self):
@@ -68,47 +70,173 @@ def unpack_data(data):
     
     return node_data, edge_data
 
-# function to handle creating nodes and edges in Neo4J
-def create_cypher_graph(driver, data):
-    # Use unpack_data subfunction to get nodes and edges
-    node_data, edge_data = unpack_data(data)
-    
-    # Subfunction to create nodes
-    def create_nodes(tx, node_list):
-        query = """
-        CREATE (n:Content {
-            node_id: $node_id,
-            node_type: $node_type,
-            name: $name,
-            content_type: $content_type,
-            href: $href,
-            filepath: $filepath,
-            keywords: $keywords,
-            summary: $summary
-        })
+NODE_PROPERTIES = ["node_id", "node_type", "name", "content_type", "href",
+                   "filepath", "toc_path", "keywords", "summary"]
+
+BATCH_SIZE = 1000
+
+
+def node_properties(node):
+    '''Return the stored properties of a node with defaults for missing keys.'''
+    props = {k: node.get(k) for k in NODE_PROPERTIES}
+    if props['keywords'] is None:
+        props['keywords'] = []
+    if props['summary'] is None:
+        props['summary'] = ''
+    if props['toc_path'] is None:
+        props['toc_path'] = ''
+    return props
+
+
+def edge_properties(edge):
+    '''Return the source and target of an edge.'''
+    return {'source': edge['source'], 'target': edge['target']}
+
+
+def format_write_stats(stats, elapsed=None):
+    '''Return a one line report of rows written and rows per second of write
+    time. With elapsed, the wall clock seconds of the run, the rows per
+    second over the run are added.'''
+    rows = stats.get("rows_written", 0)
+    seconds = stats.get("write_seconds", 0)
+    rate = rows / seconds if seconds else 0.0
+    line = "Rows written: {} in {:.1f} s ({:.0f} rows/s)".format(rows, seconds, rate)
+    if elapsed:
+        line += ", {:.0f} rows/s over {:.1f} s of run time".format(rows / elapsed, elapsed)
+    return line
+
+
+# function to create the index used to upsert nodes in Neo4J
+def ensure_schema(driver):
+    '''Create the uniqueness constraint on Content.node_id and the index on
+    Content.toc_path if they do not exist. MERGE and MATCH on node_id use
+    the constraint's index.'''
+    queries = [
         """
-        for node in node_list:
-            # Provide default values if certain keys are missing
-            node.setdefault('keywords', [])
-            node.setdefault('summary', '')
-            tx.run(query, **node)
-
-    # Subfunction to create relationships (edges)
-    def create_relationships(tx, edge_list):
-        query = """
-        MATCH (a {node_id: $source}), (b {node_id: $target})
-        CREATE (a)-[:CHILD_OF]->(b)
+        CREATE CONSTRAINT content_node_id IF NOT EXISTS
+        FOR (n:Content) REQUIRE n.node_id IS UNIQUE
+        """,
         """
-        for edge in edge_list:
-            tx.run(query, source=edge['source'], target=edge['target'])
-
-    # Run the node and relationship creation in a session
+        CREATE INDEX content_toc_path IF NOT EXISTS
+        FOR (n:Content) ON (n.toc_path)
+        """,
+    ]
     with driver.session() as session:
-        # Create nodes
-        session.write_transaction(create_nodes, node_data)
-        
-        # Create relationships
-        session.write_transaction(create_relationships, edge_data)
+        for query in queries:
+            session.run(query).consume()
+
+
+# transaction functions used to upsert TOC graphs
+def merge_nodes(tx, node_list, run_id=None):
+    '''MERGE a batch of Content nodes on node_id and set their properties,
+    stamped with the run_id of the write.'''
+    tx.run("""
+    UNWIND $rows AS row
+    MERGE (n:Content {node_id: row.node_id})
+    SET n += row, n.run_id = $run_id
+    """, rows=[node_properties(node) for node in node_list], run_id=run_id).consume()
+
+
+def merge_edges(tx, edge_list):
+    '''MERGE a batch of CHILD_OF edges between Content nodes.'''
+    tx.run("""
+    UNWIND $rows AS row
+    MATCH (a:Content {node_id: row.source})
+    MATCH (b:Content {node_id: row.target})
+    MERGE (a)-[:CHILD_OF]->(b)
+    """, rows=[edge_properties(edge) for edge in edge_list]).consume()
+
+
+def drop_toc_edges(tx, toc_paths):
+    '''Delete the CHILD_OF edges from the nodes of the TOCs.'''
+    tx.run("""
+    UNWIND $toc_paths AS toc_path
+    MATCH (a:Content {toc_path: toc_path})-[r:CHILD_OF]->(:Content)
+    DELETE r
+    """, toc_paths=list(toc_paths)).consume()
+
+
+def drop_stale_nodes(tx, toc_paths, run_id):
+    '''Delete the nodes of the TOCs that were not stamped with run_id.'''
+    tx.run("""
+    UNWIND $toc_paths AS toc_path
+    MATCH (n:Content {toc_path: toc_path})
+    WHERE n.run_id IS NULL OR n.run_id <> $run_id
+    DETACH DELETE n
+    """, toc_paths=list(toc_paths), run_id=run_id).consume()
+
+
+class CypherGraphSink:
+    '''Sink for `tocscanner.stream_tocfile` that upserts the nodes and edges
+    of a TOC in UNWIND batches inside one explicit transaction. Batches are
+    sent as they arrive, so the client holds one batch at a time. Use as a
+    context manager: the transaction is committed on a clean exit and rolled
+    back on an error, so a TOC is written whole or not at all and a failed
+    TOC can be retried without cleanup. With replace, the TOC's old CHILD_OF
+    edges are dropped first and the nodes that were not stamped with this
+    write's run id are deleted before the commit. On exit the rows written and rows per second are
+    logged.'''
+
+    def __init__(self, driver, toc_path, replace=False):
+        self.driver = driver
+        self.toc_path = toc_path
+        self.replace = replace
+        self.run_id = uuid.uuid4().hex
+        self.rows = 0
+        self.seconds = 0.0
+        self.session = None
+        self.tx = None
+
+    def __enter__(self):
+        self.session = self.driver.session()
+        self.tx = self.session.begin_transaction()
+        if self.replace:
+            drop_toc_edges(self.tx, [self.toc_path])
+        return self
+
+    def write(self, nodes, edges):
+        start = time.perf_counter()
+        if nodes:
+            merge_nodes(self.tx, nodes, self.run_id)
+        if edges:
+            merge_edges(self.tx, edges)
+        self.seconds += time.perf_counter() - start
+        self.rows += len(nodes) + len(edges)
+
+    def stats(self):
+        '''Return the rows written and the time spent writing them.'''
+        return {"rows_written": self.rows, "write_seconds": self.seconds}
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                start = time.perf_counter()
+                if self.replace:
+                    drop_stale_nodes(self.tx, [self.toc_path], self.run_id)
+                self.tx.commit()
+                self.seconds += time.perf_counter() - start
+            else:
+                self.tx.rollback()
+        finally:
+            self.tx.close()
+            self.session.close()
+        if exc_type is None:
+            logging.info("{} : {}".format(self.toc_path, format_write_stats(self.stats())))
+        return False
+
+# function to remove the graph of one or more TOCs from Neo4J
+def delete_toc_graph(driver, toc_paths):
+    '''With a list of toc.yml paths, delete the Content nodes created from
+    them along with their edges. Returns the number of nodes deleted.'''
+    query = """
+    UNWIND $toc_paths AS toc_path
+    MATCH (n:Content {toc_path: toc_path})
+    DETACH DELETE n
+    RETURN count(n) AS deleted
+    """
+    with driver.session() as session:
+        record = session.execute_write(lambda tx: tx.run(query, toc_paths=list(toc_paths)).single())
+    return record["deleted"] if record else 0
 
 # gremlin
 def create_gremlin_text(ingraph):
@@ -209,6 +337,109 @@ def make_table(in_array):
     return(out_table)
 
 
+# neo4j-admin import files
+ADMIN_FILES = {
+    "content": ["node_id:ID(Content)", "node_type", "name", "content_type", "href",
+                "filepath", "toc_path", "keywords:string[]", "summary", ":LABEL"],
+    "child_of": [":START_ID(Content)", ":END_ID(Content)", ":TYPE"],
+    "term": ["term_id:ID(Term)", "name", "description", ":LABEL"],
+    "mention": [":START_ID(Content)", ":END_ID(Term)", ":TYPE"],
+}
+ADMIN_ARRAY_DELIMITER = "|"
+ADMIN_TERMS = set()
+
+
+def prepare_admin_folder(folder):
+    '''Create the import folder, remove part files from an earlier run, and
+    write a header file for each node and relationship file.'''
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder):
+        if name.endswith(".csv"):
+            os.remove(os.path.join(folder, name))
+    for kind, header in ADMIN_FILES.items():
+        MU.write_csv([header], os.path.join(folder, "{}-header.csv".format(kind)))
+
+
+def get_admin_files(folder, kind):
+    '''Return the header file followed by the part files of a kind.'''
+    parts = sorted(n for n in os.listdir(folder) if n.startswith("{}-part-".format(kind)))
+    return [os.path.join(folder, "{}-header.csv".format(kind))] + [os.path.join(folder, n) for n in parts]
+
+
+def write_admin_command(folder, database="neo4j", terms=True):
+    '''Write the neo4j-admin command that loads the import files to
+    import-command.txt in the folder and return it.'''
+    def arg(flag, label, kind):
+        return "--{}={}={}".format(flag, label, ",".join(get_admin_files(folder, kind)))
+
+    args = ["neo4j-admin database import full",
+            arg("nodes", "Content", "content"),
+            arg("relationships", "CHILD_OF", "child_of")]
+    if terms:
+        args.append(arg("nodes", "Term", "term"))
+        args.append(arg("relationships", "MENTION", "mention"))
+    args += ["--array-delimiter=\"{}\"".format(ADMIN_ARRAY_DELIMITER),
+             "--multiline-fields=true",
+             "--skip-duplicate-nodes=true",
+             database]
+    command = " \\\n  ".join(args) + "\n"
+    MU.write_text(command, os.path.join(folder, "import-command.txt"))
+    return command
+
+
+class AdminImportSink:
+    '''Sink for `tocscanner.stream_tocfile` that appends nodes and edges to
+    this process's part files for `neo4j-admin database import`. With terms,
+    each content node's keywords are also written as Term nodes and MENTION
+    edges. Terms already written by this process are skipped; duplicates
+    across processes are skipped by the import.'''
+
+    def __init__(self, folder, terms=True):
+        self.folder = folder
+        self.terms = terms
+        self.files = {}
+        self.writers = {}
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        kinds = ["content", "child_of"] + (["term", "mention"] if self.terms else [])
+        for kind in kinds:
+            path = os.path.join(self.folder, "{}-part-{}.csv".format(kind, os.getpid()))
+            self.files[kind] = open(path, "a", newline="", encoding="utf-8")
+            self.writers[kind] = csv.writer(self.files[kind])
+        return self
+
+    def write(self, nodes, edges):
+        start = time.perf_counter()
+        for node in nodes:
+            props = node_properties(node)
+            keywords = props["keywords"] if isinstance(props["keywords"], list) else []
+            self.writers["content"].writerow(
+                [props[k] for k in NODE_PROPERTIES if k not in ("keywords", "summary")]
+                + [ADMIN_ARRAY_DELIMITER.join(keywords), props["summary"], "Content"])
+            if self.terms:
+                for keyword in sorted(set(keywords)):
+                    if keyword not in ADMIN_TERMS:
+                        ADMIN_TERMS.add(keyword)
+                        self.writers["term"].writerow([keyword, keyword, "New Term Description", "Term"])
+                    self.writers["mention"].writerow([props["node_id"], keyword, "MENTION"])
+                    self.rows += 1
+        for edge in edges:
+            self.writers["child_of"].writerow([edge["source"], edge["target"], "CHILD_OF"])
+        self.rows += len(nodes) + len(edges)
+        self.seconds += time.perf_counter() - start
+
+    def stats(self):
+        '''Return the rows written and the time spent writing them.'''
+        return {"rows_written": self.rows, "write_seconds": self.seconds}
+
+    def __exit__(self, exc_type, exc, tb):
+        for stream in self.files.values():
+            stream.close()
+        return False
+
+
 def main():
     print("This is a module of functions for the toc mapper.")
 
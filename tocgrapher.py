@@ -4,70 +4,87 @@ Workflow for module for graphing TOCs.
 2024.9.16 Matt Briggs
 '''
 
+import os
 import yaml
-import threading
 import datetime
 import time
 import logging
 
-from neo4j import GraphDatabase
-
 import tocharvestor as TH
 import tocscanner as TS
 import tocformats as TF
 import mdbutilities as MU
+import tocpool as TP
+import textcache as TC
+import tocmanifest as TM
+import tocpages as PG
+import neoconnect as NC
+import nltkdata as ND
 
 TODAYSDATE = datetime.date.fromtimestamp(time.time());
 
-TOCLIST = []
-
-
-
-def get_split(innumber):
-    '''with a number split the number into 4 ranges'''
-    size = int(innumber/4)
-    a1 = 0
-    a2 = size
-    b1 = a2 + 1
-    b2 = size *2
-    c1 = b2 +1
-    c2 = size *3
-    d1 = c2 +1
-    d2 = innumber
-
-    return [(a1,a2),(b1,b2),(c1,c2),(d1,d2)]
-
-
-def parse_toc_block(index_start, index_end, outtype, outputpath):
-    '''Pass a segment of the TOC.'''
-    toc_seg = list(TOCLIST[index_start:index_end])
-    size = len(TOCLIST)
-    for count, t, in enumerate(toc_seg):
-        print("{} of {} getting {}".format(count+index_start, size, t))
-        graphed = TS.input_tocfile(t)
-        MU.write_text(str(graphed), "C:\\git\\feature\\information-retrieval-graph-poc\\working\\data.txt")
-        if outtype == "neo4j":
-            try:
-                with open("working/fowler.yml", "r") as stream:
-                    credentials = yaml.safe_load(stream)
-                driver = GraphDatabase.driver(credentials["domain"], auth=(credentials["username"], credentials["password"]))
-                output = TF.create_cypher_graph(driver, graphed)
-                filename = outputpath + "{}-graph-{}.cypher".format(TODAYSDATE, count+index_start)
-                # MU.write_text(output, filename)
-            except Exception as e:
-                logging.error("Error neo4j for {} : {}\n".format(t, e))
-        elif outtype == "csv":
-            try:
-                filename = outputpath + "{}-graph-{}.txt".format(TODAYSDATE, count+index_start)
-                MU.write_text(str(graphed), filename)
-                TF.create_csv_check(output, graphed, count, TODAYSDATE)
-            except Exception as e:
-                logging.error("Error csv for {} : {} : {}".format(t, e, graphed))
-        else:
-            print("You need a value for the output type.")
-
 
-def main():
+def get_repo(t, folders):
+    '''Return the configured folder that contains the TOC.'''
+    matches = [f for f in folders if os.path.normcase(t).startswith(os.path.normcase(f))]
+    return max(matches, key=len) if matches else None
+
+
+def get_admin_folder(outputpath):
+    '''Return the folder for the neo4j-admin import files.'''
+    return os.path.join(outputpath, "import")
+
+
+def graph_toc(t, count, outtype, outputpath, replace=False, folders=(), batch_size=TF.BATCH_SIZE, terms=True):
+    '''Graph a single TOC and write it to the output type. For Neo4j, nodes
+    and edges are streamed to the database in batches while the TOC is
+    walked and upserted on their stable IDs. With replace, the nodes and
+    edges from a previous run of the TOC that are no longer in it are
+    deleted from Neo4j. For admin, the nodes and edges are streamed to this
+    process's neo4j-admin import part files, with Term nodes and MENTION
+    edges when terms is set. Returns a dict of the rows written and the time
+    spent writing them.'''
+    repo = get_repo(t, folders)
+    if outtype == "neo4j":
+        driver = NC.get_driver()
+        with TF.CypherGraphSink(driver, t, replace) as sink:
+            TS.stream_tocfile(t, sink, repo, maxsize=batch_size * 2, batch_size=batch_size)
+        return sink.stats()
+    elif outtype == "admin":
+        with TF.AdminImportSink(get_admin_folder(outputpath), terms) as sink:
+            TS.stream_tocfile(t, sink, repo, maxsize=batch_size * 2, batch_size=batch_size)
+        return sink.stats()
+    elif outtype == "csv":
+        graphed = TS.input_tocfile(t, repo)
+        filename = outputpath + "{}-graph-{}.txt".format(TODAYSDATE, count)
+        MU.write_text(str(graphed), filename)
+        TF.create_csv_check(outputpath, graphed, count, TODAYSDATE)
+    else:
+        print("You need a value for the output type.")
+    return {}
+
+
+def get_delta(toclist, scanned, manifestpath):
+    '''Compare the TOCs in toclist with the manifest from the previous run.
+    Returns the current manifest and the lists of added, changed, and removed
+    TOCs. Only TOCs missing from scanned, the full scan, count as removed.
+    TOCs left out of toclist by the limit keep their previous entry.'''
+    previous = TM.load_manifest(manifestpath)
+    current = TM.build_manifest(toclist, previous)
+    found = set(scanned)
+    for t in previous:
+        if t in found and t not in current:
+            current[t] = previous[t]
+    added, changed, removed = TM.diff_manifest(previous, current)
+    removed = [t for t in removed if t not in found]
+    message = "Incremental run: {} added, {} changed, {} removed, {} unchanged.".format(
+        len(added), len(changed), len(removed), len(current) - len(added) - len(changed))
+    print(message)
+    logging.info(message)
+    return previous, current, added, changed, removed
+
+
+def main(configpath="jobtoc.yml"):
     '''Builds the graph by the specified output type from a list of github 
     repositories that use the DocFX/Learn.microsoft.com content type.
     Operation: Loads a config file, counts the yml files, and parses each toc 
@@ -75,39 +92,91 @@ def main():
     or outputs graph formats to the specified file.
     
     '''
-    global TOCLIST
-
-    with open ("jobtoc.yml", "r") as stream:
+    with open (configpath, "r") as stream:
         config = yaml.safe_load(stream)
 
+    missing = ND.missing_resources(ND.INGEST)
+    if missing:
+        print("Missing NLTK data: {}. Install it with:\n{}".format(", ".join(missing), ND.download_command(missing)))
+        return
+
     outtype = config["type"].lower()
     outputpath = config["output"]
 
-    logging.basicConfig(filename="{}{}-logs.log".format(outputpath, TODAYSDATE), level=logging.INFO)
+    incremental = config.get("incremental", False)
+    if incremental and outtype != "neo4j":
+        # admin and csv output is rebuilt from scratch, so a delta would replace the full export
+        print("Incremental runs need the neo4j output type. Set incremental to false for {} output.".format(outtype))
+        return
+
+    logfile = "{}{}-logs.log".format(outputpath, TODAYSDATE)
+    logging.basicConfig(filename=logfile, level=logging.INFO)
     logging.info("Job run at: {}".format(TODAYSDATE))
 
-    for i in config["folders"]:
-        tocs = TH.get_tocs_from_repo(i["folder"])
-    
-    if config["limit"] == "0":
-        limit = len(tocs)
-    else:
-        limit = config["limit"]
+    folders = [i["folder"] for i in config["folders"]]
+    limit = int(config.get("limit") or 0)
+    tocs = TH.scan_tocs(folders, config.get("ignore"))
+    if limit or incremental:
+        # Sort the full scan so the limit picks the same TOCs on every run, and
+        # so the manifest can tell removed TOCs from ones past the limit. Without
+        # either, the scan is handed to the pool as TOCs are found.
+        scanned = sorted(tocs)
+        tocs = scanned[:limit] if limit else scanned
+
+    admin = config.get("admin") or {}
+    if outtype == "neo4j":
+        TF.ensure_schema(NC.get_driver())
+    elif outtype == "admin":
+        TF.prepare_admin_folder(get_admin_folder(outputpath))
+
+    if incremental:
+        manifestpath = config.get("manifest", "working/manifest.json")
+        previous, current, added, changed, removed = get_delta(tocs, scanned, manifestpath)
+        if removed:
+            try:
+                deleted = TF.delete_toc_graph(NC.get_driver(), removed)
+                logging.info("Deleted {} nodes from {} removed TOCs.".format(deleted, len(removed)))
+            except Exception as e:
+                logging.error("Error deleting removed TOCs : {}".format(e))
+                for t in removed:
+                    current[t] = previous[t]
+        tocs = added + changed
+
+    settings = {
+        "outtype": outtype,
+        "outputpath": outputpath,
+        "logfile": logfile,
+        "cache": config.get("cache"),
+        "replace": incremental,
+        "folders": folders,
+        "batch_size": config.get("batch_size", TF.BATCH_SIZE),
+        "terms": admin.get("terms", True),
+    }
+    start = time.perf_counter()
+    failed, stats = TP.run_pool(tocs, settings, config.get("workers", 0))
+    elapsed = time.perf_counter() - start
+    if failed:
+        logging.info("{} TOCs had errors.".format(len(failed)))
+    if incremental:
+        # Leave failed TOCs out of the manifest so the next run retries them.
+        for t in failed:
+            current.pop(t, None)
+        TM.save_manifest(current, manifestpath)
+    if outtype in ("neo4j", "admin"):
+        print(TF.format_write_stats(stats, elapsed))
+        logging.info(TF.format_write_stats(stats, elapsed))
+    if outtype == "admin":
+        command = TF.write_admin_command(get_admin_folder(outputpath), admin.get("database", "neo4j"),
+                                         admin.get("terms", True))
+        print("Load the files with:\n{}".format(command))
+    print(PG.format_stats(stats))
+    logging.info(PG.format_stats(stats))
+    if stats.get("page_errors"):
+        print("Warning: {} pages were written without keywords or a summary. See the log.".format(stats["page_errors"]))
+    if config.get("cache"):
+        print(TC.format_stats(stats))
+        logging.info(TC.format_stats(stats))
 
-    TOCLIST = tocs[:int(limit)]
-    l_indexes = get_split(len(TOCLIST))
-    
-    if len(TOCLIST) < 8:
-        parse_toc_block(0, len(TOCLIST), outtype, outputpath)
-    else:
-        threads = []
-        for i in range(4):
-            print("Thread: {}".format(i))
-            th = threading.Thread(target=parse_toc_block, args=(l_indexes[i][0], l_indexes[i][1], outtype, outputpath))
-            th.start()
-            threads.append(th)
-        [th.join() for th in threads]
-    
     print("Done.")
     logging.info("Finished: {}".format(time.localtime(time.time())))
 
@@ -6,26 +6,74 @@ Get the yaml files from a folder.
 '''
 
 import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+IGNORE_DIRS = {".git", ".github", ".vs", ".vscode", "node_modules", "media",
+               "images", "_site", "_themes", "obj", "bin"}
+
+
+def scan_folder(inpath, ignore, match):
+    '''Scan a single directory. Returns a tuple of the subdirectories to walk
+    and the paths of the files for which match(filename) is true.'''
+    subdirs = []
+    found = []
+    try:
+        with os.scandir(inpath) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name.lower() not in ignore:
+                            subdirs.append(entry.path)
+                    elif match(entry.name):
+                        found.append(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return (subdirs, found)
+
+
+def scan_files(folders, match, ignore=None, threads=None):
+    '''With a list of folders, walk the directory trees in parallel and yield
+    the path of each file for which match(filename) is true. Directories in
+    IGNORE_DIRS and in ignore are pruned. Paths are yielded as they are found,
+    so the caller can start on them before the walk is done.'''
+    skip = {i.lower() for i in IGNORE_DIRS | set(ignore or [])}
+    threads = threads or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(scan_folder, f, skip, match) for f in folders}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, found = future.result()
+                for d in subdirs:
+                    pending.add(executor.submit(scan_folder, d, skip, match))
+                for f in found:
+                    yield f
+
+
+def is_yml(filename):
+    '''Return True for files with a yml extension.'''
+    ext_index = filename.find(".")
+    return filename[ext_index+1:] == "yml"
+
+
+def is_toc(filename):
+    '''Return True for toc.yml files.'''
+    return filename.lower().endswith("toc.yml")
+
+
+def scan_tocs(folders, ignore=None, threads=None):
+    '''With a list of folders, yield the path of each toc.yml as it is found.'''
+    return scan_files(folders, is_toc, ignore, threads)
+
 
 def get_files(inpath):
     '''With the directory path, returns a list of yml file paths.
     '''
-    outlist = []
-    for (path, dirs, files) in os.walk(inpath):
-        for filename in files:
-            ext_index = filename.find(".")
-            if filename[ext_index+1:] == "yml":
-                entry = path + "\\" + filename
-                outlist.append(entry)
-    return outlist
+    return list(scan_files([inpath], is_yml))
 
 
 def get_tocs_from_repo(pathtorepo):
     '''With a path to a repostory return a list of toc.yml.'''
-    toc_paths = []
-    allfiles = get_files(pathtorepo)
-    for i in allfiles:
-        check = i.lower()
-        if check.find("toc.yml") > 0:
-            toc_paths.append(i)
-    return toc_paths
\ No newline at end of file
+    return list(scan_tocs([pathtorepo]))
@@ -1,11 +1,14 @@
 import yaml
-from neo4j import GraphDatabase, exceptions
+from neo4j import exceptions
+
+import neoconnect as NC
 
 class Neo4jConnection:
-    def __init__(self, uri, user, password):
-        """Initialize connection to Neo4j"""
+    def __init__(self, credentials_path=NC.CREDENTIALS_PATH):
+        """Borrow the shared, pooled Neo4j driver"""
+        self.credentials_path = credentials_path
         try:
-            self.driver = GraphDatabase.driver(uri, auth=(user, password))
+            self.driver = NC.get_driver(credentials_path)
             self.driver.verify_connectivity()  # Verifies the connectivity at the start
         except exceptions.Neo4jError as e:
             print(f"Error connecting to Neo4j: {e}")
@@ -13,13 +16,16 @@ class Neo4jConnection:
 
     def close(self):
         """Close the connection"""
-        if self.driver:
-            self.driver.close()
+        NC.close()
+
+    def session(self):
+        """Borrow a session from the pool with the configured fetch size"""
+        return NC.session(self.credentials_path)
 
     def run_query(self, query, parameters=None):
         """Run a query against the Neo4j database"""
         try:
-            with self.driver.session() as session:
+            with self.session() as session:
                 result = session.run(query, parameters)
                 return [record.values() for record in result]
         except exceptions.Neo4jError as e:
@@ -27,58 +33,131 @@ class Neo4jConnection:
             raise
 
 class KeywordProcessor:
-    def __init__(self, connection):
-        """Initialize with a Neo4j connection"""
+    PAGE_SIZE = 5000
+    BATCH_SIZE = 10000
+
+    def __init__(self, connection, page_size=PAGE_SIZE, batch_size=BATCH_SIZE):
+        """Initialize with a Neo4j connection, the number of Content nodes read
+        per page, and the number of rows written per UNWIND batch"""
         self.connection = connection
+        self.page_size = page_size
+        self.batch_size = batch_size
 
-    def get_keywords(self):
-        """Retrieve node_id and keywords from the database"""
+    def ensure_schema(self):
+        """Create the uniqueness constraint used to MERGE terms on term_id"""
+        self.connection.run_query("""
+        CREATE CONSTRAINT term_term_id IF NOT EXISTS
+        FOR (t:Term) REQUIRE t.term_id IS UNIQUE
+        """)
+
+    def get_keyword_pages(self):
+        """Yield pages of (node_id, keywords) from the database, reading the
+        Content nodes in node_id order with one query per page"""
         query = """
         MATCH (n:Content)
-        WHERE n.keywords IS NOT NULL AND n.node_id IS NOT NULL
-        UNWIND n.keywords as keyword
-        RETURN n.node_id, keyword;
+        WHERE n.node_id > $after AND n.keywords IS NOT NULL
+        WITH n ORDER BY n.node_id
+        LIMIT $page_size
+        RETURN n.node_id AS node_id, n.keywords AS keywords;
         """
-        try:
-            return self.connection.run_query(query)
-        except exceptions.Neo4jError as e:
-            print(f"Error retrieving keywords: {e}")
-            return []
+        after = ""
+        while True:
+            try:
+                page = self.connection.run_query(query, {"after": after, "page_size": self.page_size})
+            except exceptions.Neo4jError as e:
+                print(f"Error retrieving keywords: {e}")
+                return
+            if not page:
+                return
+            yield page
+            after = page[-1][0]
 
-    def save_terms_and_create_mentions(self, terms):
-        """Insert or update terms in the database, and create the MENTION relationship"""
-        create_term_query = """
-        MERGE (t:Term {term_id: $term_name}) 
-        ON CREATE SET t.name = $term_name, t.description = "New Term Description"
-        RETURN t;
+    def get_keywords(self):
+        """Retrieve node_id and keyword pairs from the database, page by page.
+        Pairs are grouped by node_id."""
+        for page in self.get_keyword_pages():
+            for node_id, keywords in page:
+                for keyword in keywords:
+                    yield [node_id, keyword]
+
+    def write_terms(self, term_names):
+        """MERGE a batch of Term nodes"""
+        query = """
+        UNWIND $rows AS term_name
+        MERGE (t:Term {term_id: term_name})
+        ON CREATE SET t.name = term_name, t.description = "New Term Description"
         """
-        
-        create_mention_relationship_query = """
-        MATCH (a {node_id: $node_id}), (t:Term {term_id: $term_name})
+        with self.connection.session() as session:
+            session.execute_write(lambda tx: tx.run(query, rows=term_names).consume())
+
+    def write_mentions(self, mentions):
+        """MERGE a batch of MENTION relationships from Content nodes to Terms"""
+        query = """
+        UNWIND $rows AS row
+        MATCH (a:Content {node_id: row.node_id})
+        MATCH (t:Term {term_id: row.term_name})
         MERGE (a)-[:MENTION]->(t)
-        RETURN a, t;
         """
+        with self.connection.session() as session:
+            session.execute_write(lambda tx: tx.run(query, rows=mentions).consume())
+
+    def save_terms_and_create_mentions(self, terms):
+        """Insert or update terms in the database, and create the MENTION relationship.
+
+        terms is an iterable of (node_id, term_name) pairs grouped by node_id,
+        as returned by get_keywords. Terms and pairs are deduplicated in memory
+        and written in UNWIND batches, with each batch of terms written before
+        the mentions that point to it. Returns the number of terms, mentions,
+        and write transactions."""
+        seen_terms = set()
+        seen_mentions = set()
+        current_node = None
+        new_terms = []
+        mentions = []
+        counts = {"terms": 0, "mentions": 0, "transactions": 0}
+
+        def flush_terms():
+            if new_terms:
+                self.write_terms(new_terms)
+                counts["terms"] += len(new_terms)
+                counts["transactions"] += 1
+                del new_terms[:]
+
+        def flush_mentions():
+            flush_terms()
+            if mentions:
+                self.write_mentions(mentions)
+                counts["mentions"] += len(mentions)
+                counts["transactions"] += 1
+                del mentions[:]
+                print(f"Written {counts['terms']} terms and {counts['mentions']} mentions.")
 
-        with self.connection.driver.session() as session:
-            for row in terms:
-                node_id = row[0]
-                term_name = row[1]
-                print(f"Processing term: {term_name} for node: {node_id}")
-                
-                try:
-                    # Create or update the Term node
-                    session.run(create_term_query, term_name=term_name)
-
-                    # Create the MENTION relationship between the content node and the term node
-                    session.run(create_mention_relationship_query, node_id=node_id, term_name=term_name)
-                except exceptions.Neo4jError as e:
-                    print(f"Error saving term {term_name} or creating relationship: {e}")
+        for row in terms:
+            node_id = row[0]
+            term_name = row[1]
+            if not node_id or not isinstance(term_name, str) or not term_name:
+                continue
+            if term_name not in seen_terms:
+                seen_terms.add(term_name)
+                new_terms.append(term_name)
+                if len(new_terms) >= self.batch_size:
+                    flush_terms()
+            if node_id != current_node:
+                current_node = node_id
+                seen_mentions.clear()
+            if term_name not in seen_mentions:
+                seen_mentions.add(term_name)
+                mentions.append({"node_id": node_id, "term_name": term_name})
+                if len(mentions) >= self.batch_size:
+                    flush_mentions()
+        flush_mentions()
+        print(f"Finished in {counts['transactions']} write transactions.")
+        return counts
 
 def load_credentials(file_path):
     """Load Neo4j credentials from a YAML file"""
     try:
-        with open(file_path, "r") as stream:
-            return yaml.safe_load(stream)
+        return NC.load_credentials(file_path)
     except FileNotFoundError as e:
         print(f"Credentials file not found: {e}")
         raise
@@ -89,21 +168,19 @@ def load_credentials(file_path):
 def main():
     # Load credentials and establish Neo4j connection
     try:
-        neocred = load_credentials("working/fowler.yml")
-        neo4j_conn = Neo4jConnection(neocred["domain"], neocred["username"], neocred["password"])
+        load_credentials(NC.CREDENTIALS_PATH)
+        neo4j_conn = Neo4jConnection(NC.CREDENTIALS_PATH)
     except Exception as e:
         print(f"Failed to initialize Neo4j connection: {e}")
         return
 
     try:
-        # Process keywords and create terms and relationships
+        # Stream keywords and create terms and relationships in batches
         processor = KeywordProcessor(neo4j_conn)
-        nested_list = processor.get_keywords()
+        processor.ensure_schema()
+        counts = processor.save_terms_and_create_mentions(processor.get_keywords())
 
-        # Save terms and create "MENTION" relationships
-        if nested_list:
-            processor.save_terms_and_create_mentions(nested_list)
-        else:
+        if not counts["terms"] and not counts["mentions"]:
             print("No keywords to process.")
 
     except Exception as e:
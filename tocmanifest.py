@@ -0,0 +1,135 @@
+'''
+Manifest of the TOC and markdown files graphed by a tocgrapher run.
+
+The manifest records the path, modification time, size, and hash of each
+toc.yml and of each markdown page it links to. Comparing the manifest from the
+previous run with the current files gives the TOCs that were added, changed,
+or removed, so an incremental run only has to regraph that delta.
+
+'''
+
+import os
+import json
+import hashlib
+import logging
+import yaml
+
+
+def hash_file(path):
+    '''Return the SHA-256 hex digest of a file.'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(path, previous=None):
+    '''Return a dict with the mtime, size, and hash of a file. The hash from the
+    previous entry is reused when the mtime and size have not changed.'''
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    entry = {"mtime": info.st_mtime, "size": info.st_size}
+    if previous and previous.get("mtime") == entry["mtime"] and previous.get("size") == entry["size"]:
+        entry["hash"] = previous["hash"]
+    else:
+        entry["hash"] = hash_file(path)
+    return entry
+
+
+def get_md_hrefs(tocpath):
+    '''With the path to a toc.yml return the paths of the markdown files it
+    links to, built the same way as `tocscanner.input_tocfile`.'''
+    spot = tocpath.lower().find("toc.yml")
+    stem = tocpath[0:spot]
+    try:
+        with open(tocpath, "r") as stream:
+            tocdict = yaml.load(stream, Loader=yaml.CLoader)
+    except (OSError, yaml.YAMLError) as e:
+        logging.error("Unable to read hrefs from {} : {}".format(tocpath, e))
+        return []
+    hrefs = []
+    stack = [tocdict]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            if "items" in item:
+                stack.append(item["items"])
+            elif isinstance(item.get("href"), str) and item["href"].find(".md") > 0:
+                hrefs.append(stem + item["href"])
+    return sorted(set(hrefs))
+
+
+def build_manifest(tocs, previous=None):
+    '''With a list of toc.yml paths and the previous manifest, return the
+    manifest for the current files.'''
+    previous = previous or {}
+    manifest = {}
+    for t in tocs:
+        old = previous.get(t, {})
+        entry = file_entry(t, old)
+        if entry is None:
+            continue
+        oldpages = old.get("pages", {})
+        pages = {}
+        for page in get_md_hrefs(t):
+            pages[page] = file_entry(page, oldpages.get(page))
+        entry["pages"] = pages
+        manifest[t] = entry
+    return manifest
+
+
+def toc_changed(old, new):
+    '''Return True if a TOC or any of the pages it links to has changed.'''
+    if old["hash"] != new["hash"]:
+        return True
+    oldpages = old.get("pages", {})
+    newpages = new.get("pages", {})
+    if set(oldpages) != set(newpages):
+        return True
+    for page, entry in newpages.items():
+        before = oldpages[page]
+        if (entry is None) != (before is None):
+            return True
+        if entry is not None and entry["hash"] != before["hash"]:
+            return True
+    return False
+
+
+def diff_manifest(previous, current):
+    '''Return a tuple of lists (added, changed, removed) of toc.yml paths.'''
+    added = [t for t in current if t not in previous]
+    removed = [t for t in previous if t not in current]
+    changed = [t for t in current if t in previous and toc_changed(previous[t], current[t])]
+    return (added, changed, removed)
+
+
+def load_manifest(path):
+    '''Load a manifest from a JSON file. Returns an empty manifest if the file
+    does not exist.'''
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as stream:
+        return json.load(stream)
+
+
+def save_manifest(manifest, path):
+    '''Write a manifest to a JSON file.'''
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf-8") as stream:
+        json.dump(manifest, stream, indent=1, sort_keys=True)
+    os.replace(temp, path)
+
+
+def main():
+    print("This module contains the functions for the incremental run manifest.")
+
+if __name__ == "__main__":
+    main()
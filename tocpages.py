@@ -0,0 +1,92 @@
+'''
+Run-wide registry of the markdown pages linked from TOCs.
+
+The same article is often linked from several TOC entries and from several
+toc.yml files. The registry resolves each href to a normalized absolute path
+and computes the page's metadata, keywords, and summary once per run. Worker
+processes share the registry through a `multiprocessing.Manager` dict: the
+first worker to ask for a page claims it and computes it, and any other
+worker that asks for the same page waits for the result.
+
+'''
+
+import os
+import time
+
+PENDING = "pending"
+WAIT_STEP = 0.05
+WAIT_TIMEOUT = 600
+
+
+def normalize_href(stem, href):
+    '''With the folder of a toc.yml and an href, return the normalized
+    absolute path of the page. Anchors and query strings are dropped.'''
+    href = str(href).split("#")[0].split("?")[0]
+    return os.path.normcase(os.path.abspath(os.path.join(stem, href)))
+
+
+class PageRegistry:
+
+    def __init__(self, shared=None):
+        '''With shared, a Manager dict, pages are shared across processes.
+        Without it, pages are held in a dict for this process.'''
+        self.pages = shared if shared is not None else {}
+        self.shared = shared is not None
+        self.requests = 0
+        self.computed = 0
+
+    def get(self, path, compute):
+        '''Return the data for the page at path, calling compute(path) only if
+        no process has computed it yet in this run.'''
+        self.requests += 1
+        if not self.shared:
+            if path not in self.pages:
+                self.pages[path] = compute(path)
+                self.computed += 1
+            return self.pages[path]
+
+        token = (PENDING, os.getpid())
+        current = self.pages.setdefault(path, token)
+        if current == token:
+            return self.store(path, compute)
+        waited = 0
+        while isinstance(current, tuple) and current[0] == PENDING:
+            if waited > WAIT_TIMEOUT:
+                return self.store(path, compute)
+            time.sleep(WAIT_STEP)
+            waited += WAIT_STEP
+            current = self.pages.get(path)
+            if current is None:
+                return self.store(path, compute)
+        return current
+
+    def store(self, path, compute):
+        '''Compute a page and store it in the registry.'''
+        try:
+            value = compute(path)
+        except Exception:
+            self.pages.pop(path, None)
+            raise
+        self.pages[path] = value
+        self.computed += 1
+        return value
+
+    def stats(self):
+        '''Return the page request and compute counters for this process.'''
+        return {"page_requests": self.requests, "pages_computed": self.computed}
+
+
+def format_stats(stats):
+    '''Return a one line report of the page registry counters.'''
+    requests = stats.get("page_requests", 0)
+    computed = stats.get("pages_computed", 0)
+    ratio = 100.0 * (requests - computed) / requests if requests else 0.0
+    return "Page requests: {} pages computed: {} dedup ratio: {:.1f}% page errors: {}".format(
+        requests, computed, ratio, stats.get("page_errors", 0))
+
+
+def main():
+    print("This module contains the run-wide page registry.")
+
+if __name__ == "__main__":
+    main()
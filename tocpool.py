@@ -0,0 +1,209 @@
+'''
+Process pool for graphing TOCs.
+
+The NLTK work in `tocscanner.input_tocfile` is CPU bound, so each TOC is
+handed to a separate worker process. Workers pull TOCs one at a time from the
+pool's shared task queue, biggest first, so a large TOC never holds up a
+fixed block of smaller ones.
+
+atexit handlers don't run in pool workers, so when the TOCs are done each
+worker is sent one `close_worker` task that closes its Neo4j driver and
+page cache. The tasks wait at a barrier, so no worker takes two of them.
+
+'''
+
+import os
+import re
+import heapq
+import logging
+import multiprocessing
+
+MD_HREF = re.compile(r"href:\s*['\"]?[^\s'\"#]+\.md", re.IGNORECASE)
+
+WORKER = {}
+
+WINDOW_PER_WORKER = 8
+CLOSE_TIMEOUT = 60
+
+
+def get_worker_count(setting):
+    '''With the `workers` value from jobtoc.yml return the number of processes.
+    0 or a missing value uses one worker per CPU.'''
+    try:
+        count = int(setting)
+    except (TypeError, ValueError):
+        count = 0
+    if count < 1:
+        count = os.cpu_count() or 1
+    return count
+
+
+def estimate_cost(tocpath):
+    '''With the path to a toc.yml, return the number of markdown hrefs in the
+    file as an estimate of the work needed to graph it.'''
+    try:
+        with open(tocpath, "r", encoding="utf-8", errors="ignore") as stream:
+            return len(MD_HREF.findall(stream.read()))
+    except OSError as e:
+        logging.error("Unable to estimate cost for {} : {}".format(tocpath, e))
+        return 0
+
+
+def order_by_cost(tocs, window=None):
+    '''Yield (index, tocpath) tasks biggest first. With a window, only that
+    many TOCs are held and sorted at a time, so tasks can be handed out while
+    the TOCs are still being found.'''
+    heap = []
+    for count, t in enumerate(tocs):
+        heapq.heappush(heap, (-estimate_cost(t), count, t))
+        if window and len(heap) >= window:
+            cost, index, tocpath = heapq.heappop(heap)
+            yield (index, tocpath)
+    while heap:
+        cost, index, tocpath = heapq.heappop(heap)
+        yield (index, tocpath)
+
+
+def init_worker(settings):
+    '''Pool initializer. Loads the NLTK models, the page cache, and the job
+    settings once per worker process.
+
+    settings is a dict with the keys outtype, outputpath, logfile, cache,
+    replace, folders, batch_size, terms, and pages (a Manager dict shared
+    by the workers).'''
+    import textwords as LEX
+    import tocscanner as TS
+    import textcache as TC
+    import tocpages as PG
+
+    if settings.get("logfile"):
+        logging.basicConfig(filename=settings["logfile"], level=logging.INFO)
+    WORKER.update(settings)
+    if settings.get("pages") is not None:
+        TS.set_registry(PG.PageRegistry(settings["pages"]))
+    cache = settings.get("cache")
+    if cache and cache.get("path"):
+        TS.set_cache(TC.TextCache(cache["path"], cache.get("max_mb", 512)))
+    try:
+        LEX.load_models()
+    except LookupError as e:
+        logging.error("Unable to preload NLTK models: {}".format(e))
+
+
+def close_worker(barrier=None):
+    '''Close the Neo4j driver and page cache of this process. With a barrier,
+    wait until every worker has closed, so each worker runs this once.'''
+    import neoconnect as NC
+    import tocscanner as TS
+
+    try:
+        if TS.CACHE is not None:
+            TS.CACHE.close()
+            TS.set_cache(None)
+        NC.close()
+    except Exception as e:
+        logging.error("Error closing worker {} : {}".format(os.getpid(), e))
+    if barrier is not None:
+        try:
+            barrier.wait(CLOSE_TIMEOUT)
+        except Exception as e:
+            logging.error("Worker {} did not close with the others: {}".format(os.getpid(), e))
+
+
+def preload_models():
+    '''Load the NLTK models in the parent process. Workers started with fork
+    inherit the loaded modules and tagger instead of each loading their own.'''
+    import textwords as LEX
+
+    try:
+        LEX.load_models()
+    except LookupError as e:
+        logging.error("Unable to preload NLTK models: {}".format(e))
+
+
+def stats_delta(before, after):
+    '''Return the change in each counter between two stats dicts.'''
+    return {k: after[k] - before.get(k, 0) for k in after}
+
+
+def add_stats(total, stats):
+    '''Add the counters in stats to total.'''
+    for k, v in stats.items():
+        total[k] = total.get(k, 0) + v
+
+
+def run_task(task):
+    '''Graph a single (index, tocpath) task in a worker.'''
+    import tocgrapher as TG
+    import tocscanner as TS
+
+    count, tocpath = task
+    before = TS.get_stats()
+    error = None
+    writestats = {}
+    try:
+        writestats = TG.graph_toc(tocpath, count, WORKER["outtype"], WORKER["outputpath"],
+                                  WORKER.get("replace", False), WORKER.get("folders", ()),
+                                  WORKER.get("batch_size", 1000), WORKER.get("terms", True))
+    except Exception as e:
+        logging.error("Error {} for {} : {}".format(WORKER["outtype"], tocpath, e))
+        error = str(e)
+    taskstats = stats_delta(before, TS.get_stats())
+    add_stats(taskstats, writestats)
+    return (count, tocpath, error, taskstats)
+
+
+def report_results(results, size):
+    '''Print progress as tasks finish. Returns the list of TOCs that raised
+    an error and the summed worker stats.'''
+    failed = []
+    stats = {}
+    for done, (count, tocpath, error, taskstats) in enumerate(results, start=1):
+        if size is None:
+            print("{} done {}".format(done, tocpath))
+        else:
+            print("{} of {} done {}".format(done, size, tocpath))
+        if error is not None:
+            failed.append(tocpath)
+        add_stats(stats, taskstats)
+    return failed, stats
+
+
+def run_pool(tocs, settings, workers=0):
+    '''Graph toc.yml paths with a pool of worker processes. See `init_worker`
+    for the settings. With settings["replace"], the nodes from a previous run
+    of each TOC that are no longer in it are deleted.
+
+    tocs can be a list, which is sorted biggest first before any work starts,
+    or an iterator such as `tocharvestor.scan_tocs`, in which case TOCs are
+    handed out as they are found and sorted within a window of pending TOCs.
+
+    Returns the list of TOCs that raised an error and a dict of the counters
+    summed across workers.'''
+    if isinstance(tocs, list):
+        size = len(tocs)
+        processes = min(get_worker_count(workers), max(size, 1))
+        tasks = order_by_cost(tocs)
+    else:
+        size = None
+        processes = get_worker_count(workers)
+        tasks = order_by_cost(tocs, processes * WINDOW_PER_WORKER)
+
+    if processes == 1:
+        init_worker(dict(settings, logfile=None))
+        try:
+            return report_results(map(run_task, tasks), size)
+        finally:
+            close_worker()
+
+    print("Starting {} workers.".format(processes))
+    if multiprocessing.get_start_method() == "fork":
+        preload_models()
+    with multiprocessing.Manager() as manager:
+        settings = dict(settings, pages=manager.dict())
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(settings,)) as pool:
+            try:
+                return report_results(pool.imap_unordered(run_task, tasks, chunksize=1), size)
+            finally:
+                barrier = manager.Barrier(processes)
+                pool.map(close_worker, [barrier] * processes, chunksize=1)
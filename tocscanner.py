@@ -5,14 +5,25 @@ contains two arrays. [0] is an array of nodes. [1] is an array of edges.
 '''
 
 from re import X
+import os
 import yaml
 import uuid
 import html as HTML
+import queue
 import logging
+import threading
 import mdbutilities as MU
 import markdownvalidator.mdhandler as MDH
 import textsummary as SUM
 import textwords as LEX
+import textcache as TC
+import tocpages as PG
+
+CACHE = None
+REGISTRY = PG.PageRegistry()
+PAGE_ERRORS = 0
+
+NODE_NAMESPACE = uuid.UUID("6f1c5c52-8d0e-4a4b-9a51-3d5b4f0c7e21")
 
 
 #utility functions
@@ -32,19 +43,95 @@ def escape_text(instring):
     return out
 
 
+def set_cache(cache):
+    '''Set the TextCache used for page keywords and summaries in this process.'''
+    global CACHE
+    CACHE = cache
+
+
+def set_registry(registry):
+    '''Set the PageRegistry used to share page data in this process.'''
+    global REGISTRY
+    REGISTRY = registry
+
+
+def get_stats():
+    '''Return the counters of the page registry and cache for this process,
+    and the number of pages that couldn't be processed.'''
+    stats = REGISTRY.stats()
+    stats["page_errors"] = PAGE_ERRORS
+    if CACHE is not None:
+        stats.update(CACHE.stats())
+    return stats
+
+
+def get_page_text_data(filepath):
+    '''With the path to a markdown file return a tuple of its keywords and
+    summary. The extractors only run when they miss the cache.'''
+    rawtext = MU.get_textfromfile(filepath)
+    if CACHE is None:
+        return (LEX.get_top_ten(rawtext), SUM.get_summary_text(rawtext))
+    content_hash = TC.hash_text(rawtext)
+    keywords = CACHE.get_or_compute(TC.make_key("keywords", LEX.VERSION, LEX.PARAMS, content_hash),
+                                    LEX.get_top_ten, rawtext)
+    summary = CACHE.get_or_compute(TC.make_key("summary", SUM.VERSION, SUM.PARAMS, content_hash),
+                                   SUM.get_summary_text, rawtext)
+    return (keywords, summary)
+
+
+def get_page_data(filepath):
+    '''With the path to a markdown file return a dict of its content type,
+    keywords, and summary. If the page can't be processed the content type
+    is "Error".'''
+    global PAGE_ERRORS
+    page = {}
+    try:
+        handler = MDH.MDHandler()
+        md_page = handler.get_page(filepath)
+        page["content_type"] = md_page.metadata["ms.topic"]
+        page["keywords"], page["summary"] = get_page_text_data(filepath)
+    except Exception as e:
+        logging.error("Error creating topic type for {} : error: {}".format(filepath, e))
+        PAGE_ERRORS += 1
+        page = {"content_type": "Error"}
+    return page
+
+
+def clean_path(inpath):
+    '''Normalize the separators in a path so IDs match across platforms.'''
+    return str(inpath).replace("\\", "/")
+
+
+def make_node_id(*parts):
+    '''Return a stable node ID derived from the parts that locate the node.'''
+    return str(uuid.uuid5(NODE_NAMESPACE, "|".join(str(p) for p in parts)))
+
+
 #TOC scanner function
 
-def input_tocfile(intocyaml):
-    '''With a toc yaml file return a touple of lists that contain node dicts 
-    and edge dicts'''
+def iter_tocfile(intocyaml, repo=None):
+    '''With a toc yaml file yield ("node", dict) and ("edge", dict) events as
+    the TOC is walked. A node is always yielded before the edge that points
+    to it. Node IDs are derived from the repo path, the path of the TOC in
+    the repo, and the position (toc nodes) or href (content nodes) of the
+    entry, so graphing the same TOC again gives the same IDs. The TOC is
+    walked with a stack rather than recursion, so deep TOCs can't hit the
+    recursion limit.'''
     with open (intocyaml, "r") as stream:
         tocdict = yaml.load(stream, Loader=yaml.CLoader)
 
     spot = intocyaml.lower().find("toc.yml")
     stem = intocyaml[0:spot]
 
-    # iterator to build a graph from the yaml TOC
-    rootID = str(uuid.uuid4())
+    if repo:
+        repo_key = clean_path(repo).rstrip("/")
+        toc_key = clean_path(os.path.relpath(intocyaml, repo))
+    else:
+        repo_key = ""
+        toc_key = clean_path(intocyaml)
+    href_counts = {}
+
+    rootID = make_node_id("root", repo_key, toc_key)
     rnode = {}
     rnode["node_id"] = rootID
     rnode["node_type"] = "content"
@@ -52,88 +139,148 @@ def input_tocfile(intocyaml):
     rnode["content_type"] = "root"
     rnode["href"] = "None"
     rnode["filepath"] = stem
+    rnode["toc_path"] = intocyaml
+    yield ("node", rnode)
 
-    nodes = []
-    nodes.append(rnode)
-    rels = []
+    def make_toc_node(intoc, position):
+        '''Build the node for a TOC entry that has items.'''
+        node = {}
+        node["node_id"] = make_node_id("toc", repo_key, toc_key, "/".join(map(str, position)))
+        node["node_type"] = "toc"
+        try:
+            node["name"] = intoc["name"]
+        except:
+            node["name"] = "no name"
+        node["content_type"] = "None"
+        node["href"] = "None"
+        node["filepath"] = stem
+        node["toc_path"] = intocyaml
+        return node
+
+    def make_content_node(intoc):
+        '''Build the node for a TOC entry that has an href.'''
+        node = {}
+        href_key = str(intoc["href"])
+        href_counts[href_key] = href_counts.get(href_key, 0) + 1
+        node["node_id"] = make_node_id("content", repo_key, toc_key, href_key, href_counts[href_key])
+        node["node_type"] = "content"
+        node["name"] = intoc["name"]
+        node["href"] = intoc["href"]
+        filepath = stem + str(intoc["href"])
+        node["filepath"] = filepath
+        node["toc_path"] = intocyaml
+        if intoc["href"].find(".md") > 0:
+            page = REGISTRY.get(PG.normalize_href(stem, intoc["href"]), get_page_data)
+            node.update(page)
+        else:
+            node["content_type"] = "None"
+        return node
 
-    def process_toc(intoc, parent_node):
-        '''This is a recursive function that walks the a yaml file and builds 
-        a graph object as a tuple of edges and nodes. Each tuple is an array
-        of dictionaries specifying the node and the edge.'''
-        if type(intoc) == str:
-            pass
-        elif type(intoc) == list:
-            for i in intoc:
-                process_toc(i, parent_node)
+    # Each stack entry is (yaml item, parent node ID, position in the TOC).
+    stack = [(tocdict, rootID, ())]
+    while stack:
+        intoc, parent_node, position = stack.pop()
+        if type(intoc) == list:
+            for n in range(len(intoc) - 1, -1, -1):
+                stack.append((intoc[n], parent_node, position + (n,)))
         elif type(intoc) == dict:
-            keys =  make_set(intoc)
+            keys = make_set(intoc)
             try:
                 if "items" in keys:
-                    try:
-                        node = {}
-                        edge = {}
-                        node["node_id"] = str(uuid.uuid4())
-                        node["node_type"] = "toc"
-                        node["name"] = intoc["name"]
-                        node["content_type"] = "None"
-                        node["href"] = "None"
-                        node["filepath"] = stem
-                        edge["type"] = "child"
-                        edge["source"] = parent_node
-                        edge["target"] = node["node_id"]
-                        rels.append(edge)
-                        nodes.append(node)
-                        parent_node = node["node_id"]
-                    except:
-                        node = {}
-                        edge = {}
-                        node["node_id"] = str(uuid.uuid4())
-                        node["node_type"] = "toc"
-                        node["name"] = "no name"
-                        node["content_type"] = "None"
-                        node["href"] = "None"
-                        node["filepath"] = stem
-                        edge["type"] = "child"
-                        edge["source"] = parent_node
-                        edge["target"] = node["node_id"]
-                        rels.append(edge)
-                        nodes.append(node)
-                        parent_node = node["node_id"]
-                    process_toc(intoc["items"], parent_node)
+                    node = make_toc_node(intoc, position)
                 elif "href" in keys:
-                        node = {}
-                        edge = {}
-                        node["node_id"] = str(uuid.uuid4())
-                        node["node_type"] = "content"
-                        node["name"] = intoc["name"]
-                        node["href"] = intoc["href"]
-                        filepath = stem + str(intoc["href"])
-                        node["filepath"] = filepath
-                        if intoc["href"].find(".md") > 0:
-                            try:
-                                handler = MDH.MDHandler()
-                                md_page = handler.get_page(filepath)
-                                node["content_type"] = md_page.metadata["ms.topic"]
-                                rawtext = MU.get_textfromfile(filepath)
-                                node["keywords"] = LEX.get_top_ten(rawtext)
-                                node["summary"] = SUM.get_summary_text(rawtext)
-                            except Exception as e:
-                                logging.error("Error creating topic type for {} : error: {}".format(filepath, e))
-                                node["content_type"] = "Error"
-                        else:
-                            node["content_type"] = "None"
-                        edge["type"] = "child"
-                        edge["source"] = parent_node
-                        edge["target"] = node["node_id"]
-                        rels.append(edge)
-                        nodes.append(node)
+                    node = make_content_node(intoc)
+                else:
+                    continue
             except Exception as e:
                 print("Error: {}".format(e))
-    process_toc(tocdict, rnode["node_id"])
+                continue
+            yield ("node", node)
+            yield ("edge", {"type": "child", "source": parent_node, "target": node["node_id"]})
+            if "items" in keys:
+                stack.append((intoc["items"], node["node_id"], position))
 
+
+def input_tocfile(intocyaml, repo=None):
+    '''With a toc yaml file return a touple of lists that contain node dicts 
+    and edge dicts. See `iter_tocfile`.'''
+    nodes = []
+    rels = []
+    for kind, item in iter_tocfile(intocyaml, repo):
+        if kind == "node":
+            nodes.append(item)
+        else:
+            rels.append(item)
     return (nodes, rels)
 
+
+def stream_tocfile(intocyaml, sink, repo=None, maxsize=1000, batch_size=500):
+    '''Walk a TOC in a background thread and feed its nodes and edges to a
+    sink in batches. The sink needs a write(nodes, edges) method.
+
+    Events pass through a queue that holds at most maxsize items, so the walk
+    blocks while the sink catches up and memory stays flat on large TOCs.
+    Nodes in a batch are written before its edges. Returns the number of
+    nodes and edges written.'''
+    events = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    failure = []
+
+    def put(event):
+        while not stop.is_set():
+            try:
+                events.put(event, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for event in iter_tocfile(intocyaml, repo):
+                if not put(event):
+                    return
+        except Exception as e:
+            failure.append(e)
+        finally:
+            put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    nodes = []
+    edges = []
+    counts = [0, 0]
+
+    def flush():
+        if nodes or edges:
+            sink.write(nodes, edges)
+            counts[0] += len(nodes)
+            counts[1] += len(edges)
+            del nodes[:]
+            del edges[:]
+
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            kind, item = event
+            if kind == "node":
+                nodes.append(item)
+            else:
+                edges.append(item)
+            if len(nodes) + len(edges) >= batch_size:
+                flush()
+    finally:
+        # Stop the walk if the sink failed.
+        stop.set()
+    producer.join()
+    if failure:
+        raise failure[0]
+    flush()
+    return tuple(counts)
+
+
 def main():
     pass
 
@@ -1,31 +1,38 @@
-import yaml
+import os
+import json
+import shutil
+import tempfile
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import AgglomerativeClustering
 import nltk
-from neo4j import GraphDatabase
-import openai
 import numpy as np
 
+import neoconnect as NC
+import nltkdata as ND
+import termtree as TT
+import termstream as TS
+import termcentroids as TCN
+import categorynamer as CN
+
 
 class Neo4jClusterUpdater:
-    def __init__(self, credentials_path):
-        """Initialize the Neo4j connection, OpenAI API key, and other configurations."""
+    BATCH_SIZE = 10000
+
+    def __init__(self, credentials_path, batch_size=BATCH_SIZE):
+        """Initialize the Neo4j connection, the category namer, and other configurations."""
+        self.credentials_path = credentials_path
         self.credentials = self.load_credentials(credentials_path)
-        self.driver = GraphDatabase.driver(
-            self.credentials["domain"],
-            auth=(self.credentials["username"], self.credentials["password"])
-        )
-        self.openai_key = self.credentials["openai-key"]
+        self.driver = NC.get_driver(credentials_path)
         self.context = self.credentials["content"]
-        openai.api_key = self.openai_key
+        self.namer = CN.get_namer(self.credentials)
         self.root_node_name = self.credentials["rootnode"]  # Load root node name from fowler.yml
-        nltk.download('punkt')
+        self.batch_size = batch_size
+        self.centroids_path = self.credentials.get("centroids", TCN.CENTROIDS_PATH)
+        ND.check_resources(ND.TAXONOMY)
 
     @staticmethod
     def load_credentials(file_path):
         """Load Neo4j credentials and OpenAI API key from a YAML file."""
-        with open(file_path, "r") as stream:
-            return yaml.safe_load(stream)
+        return NC.load_credentials(file_path)
 
     @staticmethod
     def clean_term_name(term_name):
@@ -34,17 +41,22 @@ class Neo4jClusterUpdater:
             return term_name.replace("'", "").strip()
         return term_name
 
+    def clean_term_names(self, term_ids):
+        """Return the cleaned name of each term_id, used to vectorize the terms."""
+        return [self.clean_term_name(t) for t in term_ids]
+
     def get_terms_from_neo4j(self):
-        """Fetch all terms from Neo4j and clean the term_id and name."""
+        """Fetch all terms from Neo4j. Returns pairs of the stored term_id, which
+        links the term to its category, and the cleaned name used to cluster it."""
         print("Fetching terms from Neo4j...")
-        with self.driver.session() as session:
+        with NC.session(self.credentials_path) as session:
             result = session.run("MATCH (t:Term) RETURN t.id AS id, t.name AS name, t.term_id AS term_id")
             terms = []
             for record in result:
                 cleaned_term_id = self.clean_term_name(record["term_id"])
                 
                 if cleaned_term_id:
-                    terms.append((record["id"], cleaned_term_id))
+                    terms.append((record["term_id"], cleaned_term_id))
         print(f"Fetched {len(terms)} valid terms.")
         return terms
 
@@ -59,148 +71,150 @@ class Neo4jClusterUpdater:
         X = vectorizer.fit_transform(processed_terms)
         return X
 
-    def perform_clustering(self, tfidf_matrix, n_clusters):
-        """Perform agglomerative clustering with a set number of clusters."""
-        clustering = AgglomerativeClustering(n_clusters=n_clusters)
-        clustering.fit(tfidf_matrix.toarray())
-        return clustering.labels_
+    def build_term_tree(self, tfidf_matrix):
+        """Reduce the TF-IDF matrix and build the one hierarchical tree the taxonomy is cut from."""
+        print("Building the term tree...")
+        return TT.build_tree(TT.reduce_terms(tfidf_matrix))
 
-    def recursive_clustering(self, tfidf_matrix, term_ids, term_names, max_terms_per_category=7, parent_category_id=None):
-        """Recursively create categories with a max of 7 terms per category."""
-        num_terms = len(term_ids)
-        
-        if num_terms == 0:
-            print(f"No terms available for clustering under parent category {parent_category_id}. Skipping...")
-            return
-        
-        if num_terms <= max_terms_per_category:
+    def plan_categories(self, tree, term_names, max_terms_per_category=7):
+        """Cut the term tree into categories with a max of 7 terms per category.
+
+        Returns a list of categories, each a dict with the index of its parent
+        category (None under the root), its terms, and whether the terms are
+        linked to it. Parents come before their children."""
+        plan = []
+        if tree.count == 0:
+            return plan
+        if tree.size(tree.root) <= max_terms_per_category:
             # Base case: If the number of terms is 7 or less, create a category directly
-            category_name = self.generate_category_name(term_names)
-            category_id = self.create_category_with_retry(category_name, parent_category_id)
-            if category_id is None:
-                print(f"Failed to create category for {category_name}")
-                return
+            plan.append({"parent": None, "terms": [term_names[i] for i in tree.leaves(tree.root)], "link": True})
+            return plan
 
-            for term in term_names:
-                if term is not None:
-                    self.link_term_to_category(term, category_id)
-                else:
-                    print(f"Skipping linking term because term_id is None.")
-        else:
-            # Recursive case: Perform clustering to divide terms into sub-categories
-            n_clusters = max(2, num_terms // max_terms_per_category)  # Ensure at least 2 clusters
-            clustering = self.perform_clustering(tfidf_matrix, n_clusters=n_clusters)
-            
-            cluster_map = {}
-            for i, cluster_id in enumerate(clustering):
-                if cluster_id not in cluster_map:
-                    cluster_map[cluster_id] = []
-                cluster_map[cluster_id].append(i)
-
-            # Process each cluster recursively
-            for cluster_id, indices in cluster_map.items():
-                sub_term_ids = [term_ids[i] for i in indices]
-                sub_term_names = [term_names[i] for i in indices]
-                sub_matrix = tfidf_matrix[indices]
-
-                # Ensure valid sub_term_ids and sub_term_names
-                if sub_term_ids and sub_term_names:
-                    # Generate a category for the current level
-                    category_name = self.generate_category_name(sub_term_names)
-                    category_id = self.create_category_with_retry(category_name, parent_category_id)
-
-                    if category_id:
-                        self.recursive_clustering(sub_matrix, sub_term_ids, sub_term_names, max_terms_per_category, category_id)
-                    else:
-                        print(f"Failed to create category {category_name}. Skipping this cluster.")
-                else:
-                    print(f"Empty sub-term or name list detected for cluster {cluster_id}. Skipping...")
+        stack = [(tree.root, None)]
+        while stack:
+            node, parent = stack.pop()
+            # Cut the tree under this node into sub-categories
+            n_clusters = max(2, tree.size(node) // max_terms_per_category)  # Ensure at least 2 clusters
+            for leaves, cluster in sorted((tree.leaves(c), c) for c in tree.split(node, n_clusters)):
+                link = len(leaves) <= max_terms_per_category
+                plan.append({"parent": parent, "terms": [term_names[i] for i in leaves], "link": link})
+                if not link:
+                    stack.append((cluster, len(plan) - 1))
+        return plan
+
+    def name_categories(self, plan):
+        """Name every category in the plan in one stage, with the cached and concurrent namer."""
+        names = self.namer.name_all([category["terms"] for category in plan])
+        for category, name in zip(plan, names):
+            category["name"] = name
+        return plan
 
     def generate_category_name(self, term_names):
-        """Generate a concise category name using OpenAI's GPT-4 based on the summary of child terms."""
-        prompt = (
-            f"Summarize the following terms into a single noun or noun cluster: {', '.join(term_names)}. "
-            f"The context is {self.context}."
-        )
+        """Generate a concise category name for a list of terms."""
+        return self.namer.name_all([list(term_names)])[0]
 
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that generates concise category names."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=50,
-                n=1,
-                temperature=0.7,
-            )
-            category_name = response['choices'][0]['message']['content'].strip()
-            return category_name
-        except Exception as e:
-            print(f"Error generating category name: {e}")
-            return "Unnamed Category"
-
-    def create_category_in_neo4j(self, category_name, parent_category_id=None):
-        """Create a category node in Neo4j, and ensure no self-referencing edges."""
-        with self.driver.session() as session:
-            if parent_category_id:
-                result = session.run("""
-                    MERGE (c:Category {name: $category_name})
-                    ON CREATE SET c.id = randomUUID()
-                    WITH c
-                    MATCH (p:Category {id: $parent_category_id})
-                    WITH p, c
-                    WHERE p.id <> c.id  // Prevent self-referencing edges
-                    MERGE (p)-[:HAS_CHILD]->(c)
-                    RETURN c.id AS category_id
-                """, category_name=category_name, parent_category_id=parent_category_id)
-            else:
-                # Create a root category if no parent exists
-                result = session.run("""
-                    MERGE (c:Category {name: $category_name})
-                    ON CREATE SET c.id = randomUUID()
-                    RETURN c.id AS category_id
-                """, category_name=category_name)
-
-            category_record = result.single()
-            return category_record["category_id"] if category_record else None
-
-    def create_category_with_retry(self, category_name, parent_category_id=None):
-        """Try to create the category. If it fails, attempt to create it with a fallback name."""
-        category_id = self.create_category_in_neo4j(category_name, parent_category_id)
-        if category_id is None:
-            # Fallback name strategy
-            fallback_name = f"Category-{np.random.randint(1000, 9999)}"
-            print(f"Retrying with fallback name: {fallback_name}")
-            category_id = self.create_category_in_neo4j(fallback_name, parent_category_id)
-        return category_id
-
-    def create_root_category(self, root_node_name):
-        """Create the root node in Neo4j."""
-        with self.driver.session() as session:
-            result = session.run("""
-                MERGE (r:Category {name: $root_node_name})
-                ON CREATE SET r.id = randomUUID()
-                RETURN r.id AS root_id
-            """, root_node_name=root_node_name)
-            root_record = result.single()
-            return root_record["root_id"] if root_record else None
-
-    def link_term_to_category(self, term, category_id):
-        """Link a term to a category in Neo4j."""
-        if not category_id or not term:
-            print(f"Skipping linking for term {term} as category_id or term_id is None.")
-            return
-        
-        with self.driver.session() as session:
-            session.run("""
-                MATCH (t:Term {term_id: $term})
-                MATCH (c:Category {id: $category_id})
-                MERGE (c)-[:HAS_TERM]->(t)
-            """, term=term, category_id=category_id)
+    def materialize_tree(self, plan, root_node_name):
+        """Return the named category tree as a dict with the root name and a list
+        of categories, each with its key, name, parent key, and linked terms.
 
-    def update_clusters_in_neo4j(self):
-        """Main function to process terms, perform clustering, and update Neo4j."""
+        A category named the same as its parent gets a fallback name, since
+        the parent and child would otherwise MERGE into one node."""
+        categories = []
+        for key, category in enumerate(plan):
+            parent_name = root_node_name if category["parent"] is None else categories[category["parent"]]["name"]
+            name = category["name"]
+            if name == parent_name:
+                # Fallback name strategy
+                name = f"Category-{np.random.randint(1000, 9999)}"
+                print(f"Using fallback name: {name}")
+            categories.append({
+                "key": key,
+                "name": name,
+                "parent": category["parent"],
+                "terms": [t for t in category["terms"] if t is not None] if category["link"] else [],
+            })
+        return {"root": root_node_name, "categories": categories}
+
+    @staticmethod
+    def save_tree(tree, output_file):
+        """Write the category tree to a JSON file instead of Neo4j."""
+        folder = os.path.dirname(output_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(tree, f, indent=1)
+        print(f"Wrote {len(tree['categories'])} categories to {output_file}")
+
+    def ensure_schema(self):
+        """Create the indexes used to MERGE categories by name and MATCH them by id."""
+        with NC.session(self.credentials_path) as session:
+            session.run("CREATE INDEX category_name IF NOT EXISTS FOR (c:Category) ON (c.name)")
+            session.run("CREATE INDEX category_id IF NOT EXISTS FOR (c:Category) ON (c.id)")
+
+    @staticmethod
+    def _merge_categories(tx, rows):
+        result = tx.run("""
+            UNWIND $rows AS name
+            MERGE (c:Category {name: name})
+            ON CREATE SET c.id = randomUUID()
+            RETURN name, c.id AS category_id
+        """, rows=rows)
+        return {record["name"]: record["category_id"] for record in result}
+
+    @staticmethod
+    def _merge_children(tx, rows):
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (p:Category {id: row.parent})
+            MATCH (c:Category {id: row.child})
+            MERGE (p)-[:HAS_CHILD]->(c)
+        """, rows=rows)
+
+    @staticmethod
+    def _merge_terms(tx, rows):
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (t:Term {term_id: row.term})
+            MATCH (c:Category {id: row.category})
+            MERGE (c)-[:HAS_TERM]->(t)
+        """, rows=rows)
+
+    def write_batches(self, work, rows):
+        """Write rows with a transaction function, one UNWIND batch per transaction."""
+        results = []
+        with NC.session(self.credentials_path) as session:
+            for i in range(0, len(rows), self.batch_size):
+                results.append(session.execute_write(work, rows[i:i + self.batch_size]))
+        return results
+
+    def write_tree(self, tree):
+        """Write the category tree with UNWIND batches of Category nodes,
+        HAS_CHILD edges, and HAS_TERM edges. Returns the id of each category."""
+        categories = tree["categories"]
+        names = list(dict.fromkeys([tree["root"]] + [c["name"] for c in categories]))
+        ids = {}
+        for batch in self.write_batches(self._merge_categories, names):
+            ids.update(batch)
+
+        children = {}
+        terms = {}
+        for category in categories:
+            parent_name = tree["root"] if category["parent"] is None else categories[category["parent"]]["name"]
+            parent_id = ids[parent_name]
+            category_id = ids[category["name"]]
+            if parent_id != category_id:  # Prevent self-referencing edges
+                children[(parent_id, category_id)] = None
+            for term in category["terms"]:
+                terms[(category_id, term)] = None
+        self.write_batches(self._merge_children, [{"parent": p, "child": c} for p, c in children])
+        self.write_batches(self._merge_terms, [{"category": c, "term": t} for c, t in terms])
+        print(f"Wrote {len(names)} categories, {len(children)} HAS_CHILD edges, and {len(terms)} HAS_TERM edges.")
+        return ids
+
+    def update_clusters_in_neo4j(self, dry_run=None):
+        """Main function to process terms, perform clustering, and update Neo4j.
+
+        With dry_run, the path to a JSON file, the category tree is written to the file instead."""
         terms = self.get_terms_from_neo4j()
         if not terms:
             print("No valid terms found. Exiting process.")
@@ -210,20 +224,258 @@ class Neo4jClusterUpdater:
 
         processed_terms = self.process_terms(term_names)
         tfidf_matrix = self.create_tfidf_matrix(processed_terms)
+        tree = self.build_term_tree(tfidf_matrix)
+        plan = self.plan_categories(tree, term_ids, max_terms_per_category=7)
+        self.name_categories(plan)
+        tree = self.materialize_tree(plan, self.root_node_name)
+
+        if dry_run:
+            self.save_tree(tree, dry_run)
+            return
 
-        # Create root node
-        root_category_id = self.create_root_category(self.root_node_name)
+        # Create the root and the categories under it
+        self.ensure_schema()
+        ids = self.write_tree(tree)
+        store = TCN.CentroidStore()
+        self.add_tree_leaves(store, tree, ids, TS.get_vectorizer())
+        self.save_centroids(store)
 
-        # Start the recursive clustering process with the root category
-        self.recursive_clustering(tfidf_matrix, term_ids, term_names, max_terms_per_category=7, parent_category_id=root_category_id)
+    def add_tree_leaves(self, store, tree, ids, vectorizer):
+        """Add the centroids of the categories with linked terms in a written tree to the store."""
+        leaves = [c for c in tree["categories"] if c["terms"]]
+        terms = []
+        groups = []
+        for leaf in leaves:
+            groups.append(range(len(terms), len(terms) + len(leaf["terms"])))
+            terms.extend(leaf["terms"])
+        if leaves:
+            store.add_leaves([ids[c["name"]] for c in leaves], [c["name"] for c in leaves], groups,
+                             vectorizer.transform(self.clean_term_names(terms)))
+
+    def save_centroids(self, store):
+        """Save the leaf centroids for incremental runs."""
+        store.save(self.centroids_path)
+        print(f"Saved {len(store)} leaf centroids to {self.centroids_path}")
+
+    def get_term_pages(self, page_size=TS.CHUNK_SIZE, unplaced=False):
+        """Yield pages of term_id values from Neo4j, reading the terms in term_id order with one query per page.
+        The stored term_id is kept so the terms can be matched again. Terms that
+        are empty once cleaned are left out.
+
+        With unplaced, only the terms that aren't linked to a category are read."""
+        after = ""
+        placed = "AND NOT (t)<-[:HAS_TERM]-(:Category)" if unplaced else ""
+        while True:
+            with NC.session(self.credentials_path) as session:
+                result = session.run(f"""
+                    MATCH (t:Term)
+                    WHERE t.term_id > $after {placed}
+                    RETURN t.term_id AS term_id
+                    ORDER BY t.term_id
+                    LIMIT $page_size
+                """, after=after, page_size=page_size)
+                page = [record["term_id"] for record in result]
+            if not page:
+                return
+            after = page[-1]
+            terms = [p for p in page if self.clean_term_name(p)]
+            if terms:
+                yield terms
+
+    def cluster_group(self, term_ids, parent_name):
+        """Cluster a group of terms exactly on their cleaned names and return its
+        named category tree under parent_name, with the terms as term_id values."""
+        try:
+            tfidf_matrix = self.create_tfidf_matrix(self.process_terms(self.clean_term_names(term_ids)))
+            plan = self.plan_categories(self.build_term_tree(tfidf_matrix), term_ids, max_terms_per_category=7)
+        except ValueError as e:
+            # All the terms are stopwords, so there is nothing to cluster on
+            print(f"Unable to cluster {len(term_ids)} terms, grouping them in order: {e}")
+            plan = [{"parent": None, "terms": list(term_ids[i:i + 7]), "link": True} for i in range(0, len(term_ids), 7)]
+        self.name_categories(plan)
+        return self.materialize_tree(plan, parent_name)
+
+    def emit(self, tree, output=None):
+        """Write a category subtree to Neo4j, or as a JSON line to output in a dry run.
+        Returns the category ids, or None in a dry run."""
+        if output is not None:
+            output.write(json.dumps(tree) + "\n")
+            return None
+        return self.write_tree(tree)
+
+    def stream_clusters_in_neo4j(self, dry_run=None):
+        """Build the taxonomy in bounded memory for very large term sets.
+
+        Terms are read once from Neo4j in pages into a spill file, and split
+        with hashing vectors and mini-batch k-means into smaller spill files,
+        until each group is small enough to cluster exactly. Each subtree is
+        written as soon as it is built. With dry_run, the subtrees are written
+        as JSON lines to the file instead."""
+        os.makedirs(TS.SPILL_DIR, exist_ok=True)
+        spill_folder = tempfile.mkdtemp(prefix="taxonomy-", dir=TS.SPILL_DIR)
+        try:
+            self.stream_partitions(spill_folder, dry_run)
+        finally:
+            shutil.rmtree(spill_folder, ignore_errors=True)
+
+    def stream_partitions(self, spill_folder, dry_run=None):
+        """Spill the terms to spill_folder and build the taxonomy from the spill files."""
+        terms = TS.spill(self.get_term_pages(), lambda chunk: [0] * len(chunk), spill_folder, "terms")
+        if not terms:
+            print("No valid terms found. Exiting process.")
+            return
+        print(f"Streaming {terms[0].count} terms.")
+
+        output = None
+        if dry_run:
+            folder = os.path.dirname(dry_run)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            output = open(dry_run, "w", encoding="utf-8")
+        else:
+            self.ensure_schema()
+        vectorizer = TS.get_vectorizer()
+        store = TCN.CentroidStore()
+        groups = 0
+        stack = [(terms[0], self.root_node_name)]
+        try:
+            self.emit({"root": self.root_node_name, "categories": []}, output)
+            while stack:
+                part, parent_name = stack.pop()
+                if part.count <= TS.LEAF_SIZE:
+                    group = [t for chunk in part.reader() for t in chunk]
+                    subtree = self.cluster_group(group, parent_name)
+                    ids = self.emit(subtree, output)
+                    if ids is not None:
+                        self.add_tree_leaves(store, subtree, ids, vectorizer)
+                else:
+                    groups += 1
+                    parts = TS.partition(part, spill_folder, "group{}".format(groups), vectorizer)
+                    plan = [{"parent": None, "terms": p.naming_sample(), "link": False} for p in parts]
+                    self.name_categories(plan)
+                    subtree = self.materialize_tree(plan, parent_name)
+                    self.emit(subtree, output)
+                    for p, category in zip(parts, subtree["categories"]):
+                        stack.append((p, category["name"]))
+                os.remove(part.path)
+            if output is None:
+                self.save_centroids(store)
+        finally:
+            if output is not None:
+                output.close()
+                print(f"Wrote the category tree to {dry_run}")
+
+    def get_category_terms(self, category_id):
+        """Return the term_id of each term linked to a category."""
+        with NC.session(self.credentials_path) as session:
+            result = session.run("""
+                MATCH (c:Category {id: $category_id})-[:HAS_TERM]->(t:Term)
+                RETURN t.term_id AS term_id
+            """, category_id=category_id)
+            return [record["term_id"] for record in result]
+
+    def unlink_category_terms(self, category_id):
+        """Delete the HAS_TERM edges of a category."""
+        with NC.session(self.credentials_path) as session:
+            session.run("""
+                MATCH (c:Category {id: $category_id})-[r:HAS_TERM]->(:Term)
+                DELETE r
+            """, category_id=category_id)
+
+    def place_new_terms(self, dry_run=None, max_terms_per_category=7):
+        """Add the terms that aren't in the taxonomy yet without clustering it again.
+
+        Each new term goes to the leaf category with the nearest centroid, and
+        only the leaves that grow past max_terms_per_category are clustered
+        again into subcategories. With dry_run, the placements and splits are
+        written to a JSON file instead of Neo4j."""
+        if not os.path.exists(self.centroids_path):
+            print(f"No leaf centroids at {self.centroids_path}. Build the taxonomy first.")
+            return
+        store = TCN.CentroidStore.load(self.centroids_path)
+        if not len(store):
+            print("The taxonomy has no leaf categories. Build the taxonomy first.")
+            return
+        if not store.compatible():
+            print(f"The leaf centroids at {self.centroids_path} were built with another vectorizer. Build the taxonomy again.")
+            return
+
+        vectorizer = TS.get_vectorizer()
+        placed = {}
+        total = 0
+        skipped = 0
+        split = []
+        try:
+            for terms in self.get_term_pages(unplaced=True):
+                vectors = vectorizer.transform(self.clean_term_names(terms))
+                # Terms made only of stopwords have no features to place them by
+                keep = np.flatnonzero(vectors.getnnz(axis=1))
+                skipped += len(terms) - len(keep)
+                if not len(keep):
+                    continue
+                terms = [terms[i] for i in keep]
+                vectors = vectors[keep]
+                leaves = store.assign(vectors)
+                if not dry_run:
+                    self.write_batches(self._merge_terms, [{"category": store.ids[l], "term": t} for l, t in zip(leaves, terms)])
+                # Count the terms only once their links are written
+                store.add_terms(leaves, vectors)
+                for leaf, term in zip(leaves, terms):
+                    placed.setdefault(int(leaf), []).append(term)
+                total += len(terms)
+            print(f"Placed {total} new terms in {len(placed)} categories.")
+            if skipped:
+                print(f"Skipped {skipped} terms with no words to place them by.")
+
+            splits = []
+            oversize = [int(leaf) for leaf in np.flatnonzero(store.counts > max_terms_per_category)]
+            for leaf in oversize:
+                category_id = store.ids[leaf]
+                terms = self.get_category_terms(category_id)
+                if dry_run:
+                    terms = list(dict.fromkeys(terms + placed.get(leaf, [])))
+                subtree = self.cluster_group(terms, store.names[leaf])
+                splits.append(subtree)
+                if not dry_run:
+                    # Write the subcategories before unlinking the terms from the leaf,
+                    # so a failed write leaves the leaf and its count as they were
+                    ids = self.write_tree(subtree)
+                    self.unlink_category_terms(category_id)
+                    self.add_tree_leaves(store, subtree, ids, vectorizer)
+                    split.append(leaf)
+            print(f"Split {len(splits)} categories that grew past {max_terms_per_category} terms.")
+        finally:
+            if not dry_run:
+                # Save the counts of what was written, even if a later write failed
+                store.remove(split)
+                self.save_centroids(store)
+
+        if dry_run:
+            folder = os.path.dirname(dry_run)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(dry_run, "w", encoding="utf-8") as f:
+                json.dump({"placed": {store.names[l]: t for l, t in placed.items()}, "splits": splits}, f, indent=1)
+            print(f"Wrote the placements to {dry_run}")
 
     def close_connection(self):
-        """Close the Neo4j connection."""
-        self.driver.close()
+        """Close the Neo4j connection and the naming cache."""
+        self.namer.close()
+        NC.close()
 
 
+def main(credentials_path=NC.CREDENTIALS_PATH, dry_run=None, stream=False, incremental=False):
+    updater = Neo4jClusterUpdater(credentials_path)
+    try:
+        if incremental:
+            updater.place_new_terms(dry_run)
+        elif stream:
+            updater.stream_clusters_in_neo4j(dry_run)
+        else:
+            updater.update_clusters_in_neo4j(dry_run)
+    finally:
+        updater.close_connection()
+
 # Usage
 if __name__ == "__main__":
-    updater = Neo4jClusterUpdater("working/fowler.yml")
-    updater.update_clusters_in_neo4j()
-    updater.close_connection()
+    main()